@@ -17,12 +17,18 @@ import torch
 from scipy.spatial.transform import Rotation as R
 
 from util import Data_loader, generate_views, get_head_global_rots
-from smpl import SMPL, poses_to_vertices
+from smpl import get_smpl, poses_to_vertices, poses_to_joints, SMPLSequence, skin_sequences
+from smpl import SkinnedVertices, skinned_vertices, VertexCache, cached_poses_to_vertices
+from smpl.rotation import axis_angle_to_matrix
 
 def vertices_to_joints(vertices, index = 15):
     # default index is head index
-    smpl = SMPL()
-    return smpl.get_full_joints(torch.FloatTensor(vertices))[..., index, :].numpy()
+    # the sequences skinned here carry their forward kinematics joints, the joints
+    # are only regressed from the mesh for vertices of unknown poses
+    if isinstance(vertices, (SMPLSequence, SkinnedVertices)):
+        return vertices.joints(index)
+    smpl = get_smpl()
+    return smpl.regress_joints(torch.FloatTensor(vertices))[..., index, :].numpy()
 
 def make_3rd_view(positions, rots, rotz=0, lookdown=12, move_back = 1, move_up = 1.0, move_right = 0.5, filter=True):
     """
@@ -35,24 +41,43 @@ def make_3rd_view(positions, rots, rotz=0, lookdown=12, move_back = 1, move_up =
       rotz: rotation around the z axis. Defaults to 0
       lookdown: the angle of the camera, in degrees. Defaults to 32
     """
-    lookdown = R.from_rotvec(np.deg2rad(-lookdown) * np.array([1, 0, 0])).as_matrix()
-    rotz = R.from_rotvec(np.deg2rad(rotz) * np.array([0, 0, 1])).as_matrix()
+    lookdown = axis_angle_to_matrix(np.deg2rad(-lookdown) * np.array([1., 0, 0]))
+    rotz = axis_angle_to_matrix(np.deg2rad(rotz) * np.array([0, 0, 1.]))
     offset = np.array([move_right, -move_back, move_up])
 
-    # rots = np.zeros_like(rots)
-    for i in range(rots.shape[0]):
-        vv = rots[i][:2,1]
-        rot = np.eye(3)
-        rot[:2,1] = vv / np.linalg.norm(vv)
-        rot[0,0] = rot[1,1]
-        rot[1,0] = -rot[0,1]
-        rots[i] =  rot @ rotz @ lookdown
+    # keep only the heading: a rotation around z from the projected y axis
+    vv = rots[:, :2, 1] / np.linalg.norm(rots[:, :2, 1], axis=-1, keepdims=True)
+    rot = np.zeros((rots.shape[0], 3, 3))
+    rot[:, :2, 1] = vv
+    rot[:, 0, 0] = vv[:, 1]
+    rot[:, 1, 0] = -vv[:, 0]
+    rot[:, 2, 2] = 1
+    rots[:] = rot @ (rotz @ lookdown)
 
     cam_pos = positions + (rots @ lookdown.T @ offset).squeeze()
     _, extrinsics = generate_views(cam_pos, rots, dist=0, rad=np.deg2rad(0), filter=filter)
     return positions, extrinsics
 
-def load_human_mesh(verts_list, human_data, start, end, pose_str='pose', pose_bak='', trans_str='trans', trans_bak='', rot=None, info='First'):
+def skin_sequence(pose, trans, beta, gender, lazy=False, cache_frames=512, dtype=np.float32, cache=None):
+    """
+    It returns the vertices of a SMPL sequence, as `SkinnedVertices` or as a
+    `SMPLSequence` skinned frame by frame when `lazy` is True, both with the forward
+    kinematics joints of the poses
+
+    `dtype` is the storage dtype of the vertices, np.float16 is only used by the lazy
+    sequences which keep the translation apart, arrays are kept at least in float32
+
+    With a `VertexCache` the sequences that are not lazy are memory-mapped float32 from
+    the cache, and skinned into it on a miss
+    """
+    if lazy:
+        return SMPLSequence(pose, trans, beta=beta, gender=gender, cache_frames=cache_frames, storage_dtype=dtype)
+    if cache is not None:
+        return cached_poses_to_vertices(pose, trans, beta=beta, gender=gender, cache=cache)
+    vertices = poses_to_vertices(pose, trans, beta=beta, gender=gender, dtype=np.promote_types(dtype, np.float32))
+    return skinned_vertices(vertices, poses_to_joints(pose, trans, beta=beta, gender=gender))
+
+def load_human_mesh(verts_list, human_data, start, end, pose_str='pose', pose_bak='', trans_str='trans', trans_bak='', rot=None, info='First', lazy=False, cache_frames=512, dtype=np.float32, cache=None):
     if pose_str not in human_data:
         pose_str = pose_bak
 
@@ -81,11 +106,16 @@ def load_human_mesh(verts_list, human_data, start, end, pose_str='pose', pose_ba
             trans = human_data[trans_str].copy()
         else:
             return
-        vert = poses_to_vertices(pose, trans, beta=beta, gender=gender)
-        verts_list[f'{info}'] = {'verts': vert[start:end], 'trans': trans[start:end], 'pose': pose[start:end]}
+        # only the displayed frames are skinned
+        pose, trans = pose[start:end], trans[start:end]
+        beta = np.asarray(beta)
+        if beta.ndim == 2 and beta.shape[0] == human_data[pose_str].shape[0]:
+            beta = beta[start:end]
+        vert = skin_sequence(pose, trans, beta, gender, lazy, cache_frames, dtype, cache)
+        verts_list[f'{info}'] = {'verts': vert, 'trans': trans, 'pose': pose}
         print(f'[SMPL MODEL] {info} ({pose_str} + {trans_str}) loaded')
 
-def load_vis_data(humans, start=0, end=-1, data_format=None):
+def load_vis_data(humans, start=0, end=-1, data_format=None, lazy=False, cache_frames=512, dtype=np.float32, cache=None):
     """
     > This function loads the SMPL model and the point cloud data into the `vis_data` dictionary
     
@@ -93,6 +123,11 @@ def load_vis_data(humans, start=0, end=-1, data_format=None):
       humans: the dictionary containing the data
       start: the start frame of the video. Defaults to 0
       end: the end frame of the video
+      lazy: keep only pose/trans/beta and skin the frames on demand. Defaults to False
+      cache_frames: max frames of skinned vertices kept per sequence when `lazy`
+      dtype: storage dtype of the vertices, np.float16 halves the lazy caches. Defaults to np.float32
+      cache: a `VertexCache` keeping the sequences that are not lazy on disk between loads.
+        Defaults to None
     """
     import os
     vis_data = {}
@@ -126,10 +161,11 @@ def load_vis_data(humans, start=0, end=-1, data_format=None):
                     else:
                         trans = humans[person]['trans'].copy()
                     local_id = [humans[person]['point_frame'].tolist().index(i) for i in global_frame_id]
-                    verts = poses_to_vertices(pose[local_id], 
-                                              trans[valid_idx], 
-                                              beta = humans[person]['beta'], 
-                                              gender=humans[person]['gender'])
+                    verts = skin_sequence(pose[local_id], 
+                                          trans[valid_idx], 
+                                          humans[person]['beta'], 
+                                          humans[person]['gender'],
+                                          lazy, cache_frames, dtype, cache)
                     vis_data['humans']['Pred(S)'] = {
                         'verts': verts, 
                         'trans': trans[valid_idx], 
@@ -155,7 +191,12 @@ def load_vis_data(humans, start=0, end=-1, data_format=None):
 
                     lidar_trans = lidar_traj[start: end] + lidar_to_head + head_to_root + smpl_offset
 
-                    vis_data['humans'][info] = {'verts': f_vert-trans[:, None, :]+lidar_trans[:, None, :], 
+                    if isinstance(f_vert, SMPLSequence):
+                        l_vert = f_vert.with_trans(lidar_trans)
+                    else:
+                        offset = (lidar_trans - trans).astype(f_vert.dtype)[:, None, :]
+                        l_vert = skinned_vertices(np.asarray(f_vert) + offset, f_vert.joints() + offset)
+                    vis_data['humans'][info] = {'verts': l_vert, 
                                                 'trans': lidar_trans.squeeze(),
                                                 'pose': pose}
                 else:
@@ -168,22 +209,53 @@ def load_vis_data(humans, start=0, end=-1, data_format=None):
                                     trans_str = values['trans'], 
                                     trans_bak = values['trans_bak'] if 'trans_bak' in values else '', 
                                     rot       = values['rot'] if 'rot' in values else None,
-                                    info      = info)
+                                    info      = info,
+                                    lazy      = lazy,
+                                    cache_frames = cache_frames,
+                                    dtype     = dtype,
+                                    cache     = cache)
 
     print(f'[SMPL LOADED] ==============')
 
     return vis_data
 
+def pool_skin_vis_data(vis_data, workers=None, dtype=np.float32):
+    """
+    It skins every lazy sequence of `vis_data` at once with a pool of `workers` processes,
+    the persons and their frame chunks are spread over the processes
+    """
+    names = [name for name, human in vis_data['humans'].items() if isinstance(human['verts'], SMPLSequence)]
+    sequences = [vis_data['humans'][name]['verts'] for name in names]
+    verts = skin_sequences(sequences,
+                           workers=workers,
+                           dtype=np.promote_types(dtype, np.float32))
+    for name, seq, vert in zip(names, sequences, verts):
+        vis_data['humans'][name]['verts'] = skinned_vertices(vert, seq.joints())
+    print(f'[SMPL MODEL] {len(names)} sequences skinned by {workers} processes')
+    return vis_data
+
 class HUMAN_DATA:
     FOV = 'first'
 
-    def __init__(self, is_remote=False, data_format=None):
+    def __init__(self, is_remote=False, data_format=None, lazy=True, cache_frames=512, dtype=np.float32, cache_dir=None):
         self.is_remote = is_remote
+        # opt-in: with `lazy=False` the skinned sequences are kept on disk in `cache_dir`
+        # (e.g. next to the pkls) and a second load only memory-maps them
+        self.vertex_cache = VertexCache(cache_dir) if cache_dir is not None else None
+        self.lazy = lazy
+        self.cache_frames = cache_frames
+        self.dtype = dtype
         self.cameras = {}
         self.humans = {}
         self.data_format = data_format
 
-    def load_pkl_file(self, filename):
+    def load_pkl_file(self, filename, workers=0):
+        """
+        Args:
+          filename: the pkl file
+          workers: skin all the sequences with a pool of processes when > 0, instead of
+            one by one (or lazily) in this process. Defaults to 0
+        """
         data_loader = Data_loader(self.is_remote)
         try:
             self.humans = data_loader.load_pkl(filename)
@@ -208,7 +280,14 @@ class HUMAN_DATA:
               }
             # second_person is optional
             """
-        self.vis_data_list = load_vis_data(self.humans, data_format = self.data_format)
+        self.vis_data_list = load_vis_data(self.humans, 
+                                           data_format = self.data_format, 
+                                           lazy = self.lazy or workers > 0, 
+                                           cache_frames = self.cache_frames,
+                                           dtype = self.dtype,
+                                           cache = self.vertex_cache)
+        if workers > 0:
+            pool_skin_vis_data(self.vis_data_list, workers, self.dtype)
         # self.set_cameras()
 
     def load_hdf5(self, filename):
@@ -315,14 +315,14 @@ class Menu(GUI_BASE):
     def _load_tracked_traj(self, path, translate=None):
         if translate is None:
             translate = [0 ,0, 0]
-        import numpy as np
+        from util import load_txt
 
         self.window.close_dialog()
         if not os.path.isfile(path):
             self.warning_info(f'{path} is not a valid file')
             return 
         try:
-            trajs = np.loadtxt(path)
+            trajs = load_txt(path)
         except:
             self.warning_info('Load traj failed.')
             return 
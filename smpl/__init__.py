@@ -1,4 +1,9 @@
-from .smpl import SMPL, poses_to_vertices
+from .smpl import SMPL, poses_to_vertices, iter_poses_to_vertices, poses_to_joints, get_smpl, get_smpl_runtime, evict_smpl
+from .smpl import update_vertices, edited_joints
+from .runtime import configure_cpu_runtime
+from .sequence import SMPLSequence, SkinnedVertices, skinned_vertices
+from .pool import skin_sequences
+from .vertex_cache import VertexCache, CachedVertices, cached_poses_to_vertices
 
 import os
-sample_path = os.path.join(os.path.dirname(__file__), 'sample.ply')
\ No newline at end of file
+sample_path = os.path.join(os.path.dirname(__file__), 'sample.ply')
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+CPU throughput benchmark of the SMPL model
+
+usage: python -m smpl.benchmark --frames 1000 10000 100000 --batch_size 1024
+       python -m smpl.benchmark --frames 10000 --json bench.json
+       python -m smpl.benchmark --frames 10000 --baseline bench.json --threshold 0.15
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import torch
+
+from smpl.smpl import get_smpl, poses_to_joints, poses_to_vertices, update_vertices
+from smpl.pool import skin_sequences
+from smpl.sequence import SMPLSequence
+from smpl.vertex_cache import VertexCache, cached_poses_to_vertices
+from smpl.runtime import CompiledSMPL, RUNTIME_MODES, configure_cpu_runtime
+from smpl.rotation import (axis_angle_to_matrix, matrix_to_axis_angle,
+                           matrix_to_rotation_6d, rotation_6d_to_matrix)
+
+
+def synthetic_sequence(n, seed=0):
+    """
+    It makes a random but plausible pose sequence
+
+    Args:
+      n: number of frames
+      seed: random seed
+
+    Returns:
+      poses (n, 72), trans (n, 3), beta (10, )
+    """
+    rng = np.random.default_rng(seed)
+    poses = (rng.standard_normal((n, 72)) * 0.2).astype(np.float32)
+    trans = np.cumsum(rng.standard_normal((n, 3)) * 0.01, axis=0).astype(np.float32)
+    beta = (rng.standard_normal(10) * 0.5).astype(np.float32)
+    return poses, trans, beta
+
+
+def loop_joint_regression(smpl, v_shaped):
+    """ The per-sample joint regression, kept as the reference of `SMPL.regress_joints` """
+    return torch.stack([torch.matmul(smpl.J_regressor, v) for v in v_shaped], dim=0)
+
+
+def check_joint_regression(smpl, batch_size=64):
+    poses, _, beta = synthetic_sequence(batch_size)
+    v_shaped = smpl.v_template[None] + torch.matmul(
+        smpl.shapedirs.view(-1, 10), torch.from_numpy(beta)).view(1, 6890, 3)
+    v_shaped = v_shaped.expand(batch_size, -1, -1) + torch.from_numpy(poses[:, :3])[:, None] * 0.01
+    diff = (smpl.regress_joints(v_shaped) - loop_joint_regression(smpl, v_shaped)).abs().max().item()
+    return diff
+
+
+def check_lbs(smpl, batch_size=64, tol=1e-5):
+    """
+    It compares the sparse skinning against the dense one on a synthetic batch
+
+    Returns:
+      max abs difference of the vertices, and whether it is within `tol` (meters)
+    """
+    poses, _, beta = synthetic_sequence(batch_size)
+    poses = torch.from_numpy(poses)
+    betas = torch.from_numpy(beta)[None].expand(batch_size, -1).contiguous()
+    sparse_lbs = smpl.sparse_lbs
+    try:
+        smpl.sparse_lbs = False
+        dense = smpl(poses, betas)
+        smpl.sparse_lbs = True
+        sparse = smpl(poses, betas)
+    finally:
+        smpl.sparse_lbs = sparse_lbs
+    diff = (sparse - dense).abs().max().item()
+    return diff, diff <= tol
+
+
+def check_update(joint=18, n=16, gender='male'):
+    """
+    It edits `joint` (default left elbow) in every frame, patches the vertices with
+    `update_vertices` and compares them against a full skinning
+
+    Returns:
+      max abs difference, number of updated vertices, seconds of the update and of the full skinning
+    """
+    poses, trans, beta = synthetic_sequence(n)
+    vertices = poses_to_vertices(poses, trans, beta, gender=gender)
+    poses[:, 3 * joint:3 * joint + 3] += 0.3
+
+    t1 = time.perf_counter()
+    index = update_vertices(vertices, poses, np.arange(n), trans, beta, gender=gender, joints=[joint])
+    t2 = time.perf_counter()
+    full = poses_to_vertices(poses, trans, beta, gender=gender)
+    t3 = time.perf_counter()
+    return float(np.abs(vertices - full).max()), len(index), t2 - t1, t3 - t2
+
+
+def bench_forward(smpl, n, batch_size=1024, constant_beta=True):
+    """
+    It runs `SMPL.forward` over a synthetic sequence of n frames and drops the vertices,
+    with one shared beta (as `poses_to_vertices` does) or a beta per frame
+
+    Returns:
+      frames per second
+    """
+    poses, _, beta = synthetic_sequence(min(n, batch_size))
+    poses = torch.from_numpy(poses)
+    betas = torch.from_numpy(beta)[None]
+    if not constant_beta:
+        betas = betas.expand(poses.shape[0], -1).contiguous()
+    smpl(poses[:1], betas[:1])  # warm up
+
+    t1 = time.perf_counter()
+    done = 0
+    while done < n:
+        bs = min(batch_size, n - done)
+        smpl(poses[:bs], betas if constant_beta else betas[:bs])
+        done += bs
+    return n / (time.perf_counter() - t1)
+
+
+def bench_runtime(smpl, mode, batch_size, n_iter=5):
+    """
+    It times a `CompiledSMPL` runtime on one batch, the first (compiling) call is excluded
+
+    Returns:
+      frames per second
+    """
+    poses, _, beta = synthetic_sequence(batch_size)
+    poses = torch.from_numpy(poses)
+    beta = torch.from_numpy(beta)[None]
+    runtime = CompiledSMPL(smpl, mode=mode, batch_size=batch_size)
+    runtime(poses, beta)
+
+    t1 = time.perf_counter()
+    for _ in range(n_iter):
+        runtime(poses, beta)
+    return batch_size * n_iter / (time.perf_counter() - t1)
+
+
+def bench_joints(n, gender='male'):
+    """
+    It times `poses_to_joints`, the joint-only forward kinematics of a whole sequence
+
+    Returns:
+      frames per second
+    """
+    poses, trans, beta = synthetic_sequence(n)
+    poses_to_joints(poses[:1], trans[:1], beta, gender=gender)  # warm up
+    t1 = time.perf_counter()
+    poses_to_joints(poses, trans, beta, gender=gender)
+    return n / (time.perf_counter() - t1)
+
+
+def bench_rotations(n, repeat=3):
+    """
+    It times the (n x 24) rotation conversions of `smpl.rotation` with both backends
+
+    Returns:
+      {name: million rotations per second}, and the max axis-angle round trip error
+    """
+    poses, _, _ = synthetic_sequence(n)
+    inputs = {'numpy': poses.reshape(n, 24, 3), 'torch': torch.from_numpy(poses).view(n, 24, 3)}
+    results = {}
+    error = 0
+    for backend, aa in inputs.items():
+        convs = [('axis_angle_to_matrix', axis_angle_to_matrix, aa),
+                 ('matrix_to_axis_angle', matrix_to_axis_angle, axis_angle_to_matrix(aa)),
+                 ('rotation_6d_to_matrix', rotation_6d_to_matrix, matrix_to_rotation_6d(axis_angle_to_matrix(aa)))]
+        for name, func, x in convs:
+            t1 = time.perf_counter()
+            for _ in range(repeat):
+                func(x)
+            results[f'{backend} {name}'] = n * 24 * repeat / (time.perf_counter() - t1) / 1e6
+        error = max(error, float(np.abs(np.asarray(matrix_to_axis_angle(axis_angle_to_matrix(aa))) - poses.reshape(n, 24, 3)).max()))
+    return results, error
+
+
+def bench_pool(n, persons=3, workers=1, gender='male'):
+    """
+    It skins `persons` sequences of n frames with `skin_sequences` and `workers` processes,
+    the spawn of the pool is included
+
+    Returns:
+      frames per second
+    """
+    sequences = []
+    for seed in range(persons):
+        poses, trans, beta = synthetic_sequence(n, seed)
+        sequences.append(SMPLSequence(poses, trans, beta, gender=gender))
+    t1 = time.perf_counter()
+    skin_sequences(sequences, workers=workers)
+    return n * persons / (time.perf_counter() - t1)
+
+
+def bench_vertex_cache(n, cache_dir, gender='male'):
+    """
+    It loads a sequence of n frames through an empty `VertexCache`, then again from the cache
+
+    Returns:
+      seconds of the first (skinning) and of the second (cached) load
+    """
+    poses, trans, beta = synthetic_sequence(n)
+    cache = VertexCache(cache_dir)
+    cache.clear()
+    times = []
+    for _ in range(2):
+        t1 = time.perf_counter()
+        vertices = cached_poses_to_vertices(poses, trans, beta, gender=gender, cache=cache)
+        vertices.joints(15)
+        times.append(time.perf_counter() - t1)
+    cache.clear()
+    return times
+
+
+# growth of the stage memory below this is noise, not a regression
+MEMORY_SLACK_MB = 16
+
+
+def process_peak_rss_mb():
+    """ The peak resident memory of the whole process lifetime in MB, None where it is not available """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def _proc_status_mb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """ It resets the peak resident memory (VmHWM) of the process, False where it cannot (Linux only) """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _stage(results, name, n, func):
+    # the peak is reset before every stage, so it is the peak of this stage alone
+    rss = _proc_status_mb('VmRSS') if reset_peak_rss() else None
+    t1 = time.perf_counter()
+    out = func()
+    seconds = time.perf_counter() - t1
+    peak = None if rss is None else _proc_status_mb('VmHWM')
+    results[name] = {'frames': n,
+                     'seconds': seconds,
+                     'fps': n / seconds if seconds > 0 else float('inf'),
+                     'peak_rss_mb': peak,
+                     'rss_growth_mb': None if peak is None else peak - rss}
+    return out
+
+
+def run_suite(n, batch_size=1024, gender='male'):
+    """
+    It times every stage of the model engine on a synthetic sequence of n frames
+
+    Returns:
+      {stage: {'frames', 'seconds', 'fps', 'peak_rss_mb', 'rss_growth_mb'}}, the memory of
+      a stage is its own peak and its growth over the memory before it, None where the
+      peak cannot be reset
+    """
+    smpl = get_smpl(gender=gender)
+    poses, trans, beta = synthetic_sequence(n)
+    results = {}
+
+    def forward():
+        with torch.no_grad():
+            for lb in range(0, n, batch_size):
+                smpl(torch.from_numpy(poses[lb:lb + batch_size]), torch.from_numpy(beta)[None])
+
+    bs = min(n, batch_size)
+    smpl(torch.from_numpy(poses[:1]), torch.from_numpy(beta)[None])  # warm up
+    _stage(results, 'SMPL.forward', n, forward)
+    vertices = _stage(results, 'poses_to_vertices', n,
+                      lambda: poses_to_vertices(poses, trans, beta, batch_size=batch_size, gender=gender))
+    _stage(results, 'get_full_joints', bs,
+           lambda: smpl.get_full_joints(torch.from_numpy(vertices[:bs])))
+    _stage(results, 'poses_to_joints', n, lambda: poses_to_joints(poses, trans, beta, gender=gender))
+
+    try:
+        from gui_vis.human_data import vertices_to_joints, load_vis_data
+    except ImportError as e:
+        print(f'[WARNING] gui_vis stages skipped: {e}')
+        return results
+    _stage(results, 'vertices_to_joints', n, lambda: vertices_to_joints(vertices, 15))
+
+    humans = {'second_person': {'pose': poses, 'trans': trans, 'beta': beta, 'gender': gender},
+              'frame_num': list(range(n))}
+    data_format = {'second_person': {'Baseline2(S)': {'pose': 'pose', 'trans': 'trans'}}}
+    _stage(results, 'load_vis_data', n, lambda: load_vis_data(humans, data_format=data_format))
+    return results
+
+
+def compare_to_baseline(report, baseline, threshold=0.1):
+    """
+    It compares the fps and the memory growth of every stage with a saved report
+
+    Args:
+      report: the current report of `run_suite` runs, {frames: {stage: {...}}}
+      baseline: a report saved by `--json`
+      threshold: the relative fps drop, or memory growth beyond `MEMORY_SLACK_MB`,
+        counted as a regression. Defaults to 0.1
+
+    Returns:
+      A list of (frames, stage, metric, baseline, value) of the regressions
+    """
+    regressions = []
+    for frames, stages in report['results'].items():
+        for stage, result in stages.items():
+            base = baseline.get('results', {}).get(frames, {}).get(stage)
+            if base is None:
+                continue
+            drop = 1 - result['fps'] / base['fps']
+            status = 'REGRESSION' if drop > threshold else 'OK'
+            print(f'[{status:>10s}] {stage:>18s} {frames:>7s} frames: '
+                  f'{base["fps"]:10.1f} -> {result["fps"]:10.1f} frames/s ({-drop:+.1%})')
+            if drop > threshold:
+                regressions.append((frames, stage, 'fps', base['fps'], result['fps']))
+
+            base_mb, mb = base.get('rss_growth_mb'), result.get('rss_growth_mb')
+            if base_mb is None or mb is None:
+                continue
+            worse = mb - base_mb > max(threshold * base_mb, MEMORY_SLACK_MB)
+            status = 'REGRESSION' if worse else 'OK'
+            print(f'[{status:>10s}] {stage:>18s} {frames:>7s} frames: '
+                  f'{base_mb:10.1f} -> {mb:10.1f} MB of memory growth')
+            if worse:
+                regressions.append((frames, stage, 'rss_growth_mb', base_mb, mb))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--batch_size', type=int, default=1024)
+    parser.add_argument('--gender', type=str, default='male')
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--runtime_batch_sizes', type=int, nargs='+', default=[1, 64, 1024])
+    parser.add_argument('--pool_workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--pool_persons', type=int, default=3)
+    parser.add_argument('--cache_dir', type=str, default='')
+    parser.add_argument('--json', type=str, default='', help='run the stage suite and save its report')
+    parser.add_argument('--baseline', type=str, default='', help='run the stage suite and compare to this report')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative fps drop of a regression')
+    args = parser.parse_args()
+
+    configure_cpu_runtime(threads=args.threads if args.threads > 0 else None)
+
+    if args.json or args.baseline:
+        report = {'machine': {'platform': platform.platform(),
+                              'python': platform.python_version(),
+                              'torch': torch.__version__,
+                              'threads': torch.get_num_threads()},
+                  'batch_size': args.batch_size,
+                  'results': {str(n): run_suite(n, args.batch_size, args.gender) for n in args.frames}}
+        report['process_peak_rss_mb'] = process_peak_rss_mb()
+        print(json.dumps(report, indent=2))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if compare_to_baseline(report, baseline, args.threshold):
+                sys.exit(1)
+        sys.exit(0)
+
+    smpl = get_smpl(gender=args.gender)
+    print(f'[Joint regression] max abs diff to per-sample loop: {check_joint_regression(smpl):.3e}')
+    diff, ok = check_lbs(smpl)
+    print(f'[LBS] top-{smpl.lbs_topk} sparse vs dense max abs diff: {diff:.3e} ({"OK" if ok else "FAILED"})')
+    diff, n_verts, t_update, t_full = check_update(gender=args.gender)
+    print(f'[update_vertices] {n_verts} vertices updated in {t_update * 1000:.1f}ms '
+          f'(full {t_full * 1000:.1f}ms), max abs diff {diff:.3e}')
+    for batch_size in args.runtime_batch_sizes:
+        for mode in RUNTIME_MODES:
+            fps = bench_runtime(smpl, mode, batch_size)
+            print(f'[SMPL runtime {mode:>7s}] batch {batch_size:>5d}: {fps:10.1f} frames/s')
+
+    for n in args.frames:
+        fps = bench_joints(n, args.gender)
+        print(f'[poses_to_joints] {n:>7d} frames: {fps:10.1f} frames/s')
+
+    for n in args.frames:
+        results, error = bench_rotations(n)
+        for name, mrps in results.items():
+            print(f'[Rotation {name}] {n:>7d} x 24: {mrps:8.2f} M rotations/s')
+        print(f'[Rotation] axis-angle round trip max error: {error:.3e}')
+
+    for n in args.frames:
+        for sparse_lbs in [False, True]:
+            for constant_beta in [False, True]:
+                smpl.sparse_lbs = sparse_lbs
+                fps = bench_forward(smpl, n, args.batch_size, constant_beta)
+                print(f'[SMPL.forward {"sparse" if sparse_lbs else "dense "} '
+                      f'{"const beta" if constant_beta else "frame beta"}] {n:>7d} frames: {fps:10.1f} frames/s')
+
+    for n in args.frames:
+        for workers in args.pool_workers:
+            fps = bench_pool(n, args.pool_persons, workers, args.gender)
+            print(f'[skin_sequences] {args.pool_persons} x {n:>7d} frames, {workers:>2d} processes: {fps:10.1f} frames/s')
+
+    if args.cache_dir:
+        for n in args.frames:
+            first, second = bench_vertex_cache(n, args.cache_dir, args.gender)
+            print(f'[VertexCache] {n:>7d} frames: skinned in {first:.3f}s, cached load in {second:.3f}s')
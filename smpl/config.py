@@ -15,6 +15,23 @@ SMPL_FILE = os.path.dirname(__file__)
 # seems all zeros.
 JOINT_REGRESSOR_TRAIN_EXTRA = os.path.join(os.path.dirname(__file__), 'J_regressor_extra.npy')
 
+SMPL_MODEL_FILES = {
+    'male': os.path.join(SMPL_FILE, 'SMPL_male_V1.pkl'),
+    'female': os.path.join(SMPL_FILE, 'SMPL_female_V1.pkl'),
+}
+# precompiled bundles written by `python -m smpl.model_file`
+SMPL_BUNDLE_DIRS = {
+    'male': os.path.join(SMPL_FILE, 'SMPL_male_V1'),
+    'female': os.path.join(SMPL_FILE, 'SMPL_female_V1'),
+}
+
+# runtime of poses_to_vertices: 'eager', 'script' (traced TorchScript) or 'compile' (torch.compile)
+SMPL_RUNTIME = 'eager'
+
+# persistent cache of skinned sequences, see smpl/vertex_cache.py
+SMPL_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'smpl_vertices')
+SMPL_CACHE_MAX_BYTES = 20 * 1024 ** 3
+
 """
 Each dataset uses different sets of joints.
 We keep a superset of 24 joints such that we include all joints from every dataset.
@@ -7,38 +7,164 @@
 ________________________,--._(___Y___)_,--._______________________
                         `--'           `--'
 '''
-import numpy as np
 import os
-import pickle
-import cv2 as cv
-import config as cfg
-from .config import SMPL_FILE
-
-def save_ply(vertice, out_file):
-    model_file = SMPL_FILE
-    with open(model_file, 'rb') as f:
-        smpl_model = pickle.load(f, encoding='iso-8859-1')
-        face_index = smpl_model['f'].astype(np.int64)
-    face_1 = np.ones((face_index.shape[0], 1))
-    face_1 *= 3
-    face = np.hstack((face_1, face_index)).astype(int)
-    if os.path.exists(out_file):
-        os.remove(out_file)
-    with open(out_file, "ab") as zjy_f:
-        np.savetxt(zjy_f, vertice, fmt='%f %f %f')
-        np.savetxt(zjy_f, face, fmt='%d %d %d %d')
-    ply_header = '''ply
-format ascii 1.0
-element vertex 6890
-property float x
-property float y
-property float z
-element face 13776
-property list uchar int vertex_indices
-end_header
-    '''
-    with open(out_file, 'r+') as f:
-        old = f.read()
-        f.seek(0)
-        f.write(ply_header)
-        f.write(old)
+import struct
+
+import numpy as np
+
+from .model_file import load_smpl_model
+
+'''
+Mesh sequence file (.smplseq), little endian:
+    magic       8 bytes  b'SMPLSEQ1'
+    n_vertices  uint32
+    n_faces     uint32
+    faces       int32   (n_faces, 3), written once
+    vertices    float32 (n_vertices, 3) per frame, appended frame after frame
+The number of frames follows from the file size, a sequence is memory-mapped by
+`read_mesh_sequence`.
+'''
+SEQUENCE_MAGIC = b'SMPLSEQ1'
+_HEADER = struct.Struct('<8sII')
+
+_FACES = {}
+
+
+def smpl_faces(gender='male'):
+    """ The (13776, 3) int32 faces of the SMPL model, loaded once """
+    if gender not in _FACES:
+        _FACES[gender] = np.ascontiguousarray(load_smpl_model(gender)['faces'], dtype=np.int32)
+    return _FACES[gender]
+
+
+def save_ply(vertice, out_file, faces=None):
+    """
+    It writes one mesh as a binary PLY
+
+    Args:
+      vertice: (V, 3) vertices
+      out_file: the .ply file
+      faces: (F, 3) faces. Defaults to the SMPL faces
+    """
+    faces = smpl_faces() if faces is None else faces
+    vertice = np.ascontiguousarray(vertice, dtype='<f4')
+    face = np.empty(len(faces), dtype=[('n', 'u1'), ('index', '<i4', (3,))])
+    face['n'] = 3
+    face['index'] = faces
+
+    ply_header = ('ply\n'
+                  'format binary_little_endian 1.0\n'
+                  f'element vertex {len(vertice)}\n'
+                  'property float x\n'
+                  'property float y\n'
+                  'property float z\n'
+                  f'element face {len(faces)}\n'
+                  'property list uchar int vertex_indices\n'
+                  'end_header\n')
+    with open(out_file, 'wb') as f:
+        f.write(ply_header.encode('ascii'))
+        f.write(vertice.tobytes())
+        f.write(face.tobytes())
+
+
+def save_obj(vertice, out_file, faces=None):
+    """
+    It writes one mesh as an OBJ, formatted in one pass
+
+    Args:
+      vertice: (V, 3) vertices
+      out_file: the .obj file
+      faces: (F, 3) faces, 0-based. Defaults to the SMPL faces
+    """
+    faces = smpl_faces() if faces is None else faces
+    vertice = np.asarray(vertice, dtype=np.float32)
+    lines = (('v %f %f %f\n' * len(vertice)) % tuple(vertice.ravel()) +
+             ('f %d %d %d\n' * len(faces)) % tuple((np.asarray(faces) + 1).ravel()))
+    with open(out_file, 'w') as f:
+        f.write(lines)
+
+
+class MeshSequenceWriter(object):
+    """
+    It streams the frames of a mesh sequence into one .smplseq file, the faces are
+    written once and every frame is its raw float32 vertices
+
+    Args:
+      out_file: the .smplseq file
+      faces: (F, 3) faces. Defaults to the SMPL faces
+      n_vertices: vertices per frame. Defaults to 6890
+
+    usage:
+        with MeshSequenceWriter(out_file) as writer:
+            for lb, ub, vertices in iter_poses_to_vertices(poses, trans):
+                writer.write(vertices)
+    """
+
+    def __init__(self, out_file, faces=None, n_vertices=6890):
+        faces = smpl_faces() if faces is None else np.asarray(faces)
+        self.out_file = out_file
+        self.n_vertices = n_vertices
+        self.n_frames = 0
+        self._file = open(out_file, 'wb')
+        self._file.write(_HEADER.pack(SEQUENCE_MAGIC, n_vertices, len(faces)))
+        self._file.write(np.ascontiguousarray(faces, dtype='<i4').tobytes())
+
+    def write(self, vertices):
+        """ It appends (V, 3) or a batch (B, V, 3) of frames """
+        vertices = np.ascontiguousarray(vertices, dtype='<f4').reshape(-1, self.n_vertices, 3)
+        self._file.write(vertices.data)
+        self.n_frames += len(vertices)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_mesh_sequence(in_file):
+    """
+    It memory-maps a .smplseq file
+
+    Returns:
+      faces (F, 3), vertices (N, V, 3) float32 memory-mapped
+    """
+    with open(in_file, 'rb') as f:
+        magic, n_vertices, n_faces = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != SEQUENCE_MAGIC:
+        raise ValueError(f'{in_file} is not a mesh sequence file')
+    faces = np.memmap(in_file, dtype='<i4', mode='r', offset=_HEADER.size, shape=(n_faces, 3))
+    offset = _HEADER.size + n_faces * 3 * 4
+    n_frames = (os.path.getsize(in_file) - offset) // (n_vertices * 3 * 4)
+    if n_frames == 0:
+        return np.asarray(faces), np.empty((0, n_vertices, 3), dtype=np.float32)
+    vertices = np.memmap(in_file, dtype='<f4', mode='r', offset=offset, shape=(n_frames, n_vertices, 3))
+    return np.asarray(faces), vertices
+
+
+def export_frames(in_file, out_dir, frames=None, fmt='ply'):
+    """
+    It exports frames of a .smplseq file as single meshes, on demand
+
+    Args:
+      in_file: the .smplseq file
+      out_dir: the output folder
+      frames: the frames to export. Defaults to all of them
+      fmt: 'ply' (binary) or 'obj'
+
+    Returns:
+      The written files.
+    """
+    faces, vertices = read_mesh_sequence(in_file)
+    save = {'ply': save_ply, 'obj': save_obj}[fmt]
+    os.makedirs(out_dir, exist_ok=True)
+    frames = range(len(vertices)) if frames is None else frames
+    out_files = []
+    for i in frames:
+        out_files.append(os.path.join(out_dir, f'{i}_smpl.{fmt}'))
+        save(vertices[i], out_files[-1], faces)
+    return out_files
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+SMPL model files
+
+The official pkl needs chumpy/scipy and a full unpickle on every load, so it is
+converted once into a bundle: a folder of plain .npy arrays which is memory-mapped
+by `load_smpl_model`, every process loading the model shares the same pages.
+
+usage: python -m smpl.model_file --gender male female
+"""
+import os
+import pickle
+import shutil
+import argparse
+
+import numpy as np
+
+import smpl.config as cfg
+
+BUNDLE_ARRAYS = {
+    'v_template': np.float32,       # (6890, 3)
+    'shapedirs': np.float32,        # (6890, 3, 10)
+    'posedirs': np.float32,         # (6890, 3, 207)
+    'weights': np.float32,          # (6890, 24)
+    'J_regressor': np.float32,      # (24, 6890), dense
+    'J_regressor_extra': np.float32,
+    'faces': np.int64,              # (13776, 3)
+    'kintree_table': np.int64,      # (2, 24)
+}
+
+
+def _model_paths(gender):
+    if gender not in cfg.SMPL_MODEL_FILES:
+        raise ValueError('Unknown gender: %s' % gender)
+    return cfg.SMPL_MODEL_FILES[gender], cfg.SMPL_BUNDLE_DIRS[gender]
+
+
+def read_smpl_pkl(model_file):
+    """
+    It unpickles the official SMPL model and converts it to plain numpy arrays
+
+    Returns:
+      A dict with the arrays of `BUNDLE_ARRAYS`
+    """
+    with open(model_file, 'rb') as f:
+        smpl_model = pickle.load(f, encoding='iso-8859-1')
+
+    model = {
+        'v_template': np.array(smpl_model['v_template']),
+        'shapedirs': np.array(smpl_model['shapedirs']),
+        'posedirs': np.array(smpl_model['posedirs']),
+        'weights': np.array(smpl_model['weights']),
+        'J_regressor': smpl_model['J_regressor'].toarray(),
+        'J_regressor_extra': np.load(cfg.JOINT_REGRESSOR_TRAIN_EXTRA),
+        'faces': smpl_model['f'],
+        'kintree_table': smpl_model['kintree_table'],
+    }
+    return {k: np.ascontiguousarray(v, dtype=BUNDLE_ARRAYS[k]) for k, v in model.items()}
+
+
+def convert_smpl_model(gender, bundle_dir=None):
+    """
+    It writes the SMPL model of `gender` into a bundle folder of .npy arrays
+
+    Args:
+      gender: 'male' or 'female'
+      bundle_dir: the output folder. Defaults to `cfg.SMPL_BUNDLE_DIRS[gender]`
+
+    Returns:
+      The bundle folder.
+    """
+    model_file, default_dir = _model_paths(gender)
+    bundle_dir = default_dir if bundle_dir is None else bundle_dir
+    model = read_smpl_pkl(model_file)
+
+    # write aside and swap, a reader never sees a half-written bundle
+    tmp_dir = bundle_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in model.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), array)
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    os.replace(tmp_dir, bundle_dir)
+    return bundle_dir
+
+
+def is_bundle_valid(bundle_dir, model_file=None):
+    """ The bundle is complete and not older than its source pkl """
+    if not all(os.path.isfile(os.path.join(bundle_dir, k + '.npy')) for k in BUNDLE_ARRAYS):
+        return False
+    if model_file is not None and os.path.isfile(model_file):
+        return os.path.getmtime(bundle_dir) >= os.path.getmtime(model_file)
+    return True
+
+
+def load_smpl_model(gender):
+    """
+    It loads the SMPL model arrays, memory-mapped from the bundle if it exists,
+    otherwise from the official pkl
+
+    Args:
+      gender: 'male' or 'female'
+
+    Returns:
+      A dict with the arrays of `BUNDLE_ARRAYS`
+    """
+    model_file, bundle_dir = _model_paths(gender)
+    if is_bundle_valid(bundle_dir, model_file):
+        # copy-on-write: shared read-only pages, but writable for torch.from_numpy
+        return {k: np.load(os.path.join(bundle_dir, k + '.npy'), mmap_mode='c') for k in BUNDLE_ARRAYS}
+    return read_smpl_pkl(model_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--gender', type=str, nargs='+', default=['male', 'female'])
+    args = parser.parse_args()
+
+    for gender in args.gender:
+        print(f'[SMPL MODEL] {gender} bundle saved in {convert_smpl_model(gender)}')
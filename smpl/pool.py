@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process SMPL skinning
+
+The frames of several sequences are split into chunks and skinned by a pool of
+single-threaded worker processes, every worker writes its chunk straight into the
+shared-memory output of its sequence, nothing is pickled back.
+"""
+import os
+import weakref
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from smpl.smpl import poses_to_vertices
+
+
+def _shared_array(shape, dtype):
+    """
+    It allocates an array in a new SharedMemory block
+
+    Returns:
+      The array, and the SharedMemory to attach to it by name and to unlink.
+    """
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    array = np.frombuffer(memoryview(shm.buf), dtype=dtype, count=int(np.prod(shape)))
+    # the base is a memoryview of its own, it releases the mapping before its weakref
+    # callbacks run, so the block is closed once the array and all its views are gone
+    closer = weakref.finalize(array.base, shm.close)
+    # arrays still alive at exit keep their mapping, the os releases it
+    closer.atexit = False
+    return array.reshape(shape), shm
+
+
+def _init_worker(threads):
+    # the parallelism comes from the processes
+    torch.set_num_threads(threads)
+
+
+def _skin_chunk(name, shape, dtype, lb, poses, trans, beta, gender, batch_size):
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        out = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        poses_to_vertices(poses, trans, beta=beta, batch_size=batch_size, gender=gender,
+                          out=out[lb:lb + len(poses)])
+        del out
+    finally:
+        shm.close()
+    return len(poses)
+
+
+def skin_sequences(sequences, workers=None, chunk_frames=512, batch_size=128,
+                   dtype=np.float32, mp_context='spawn'):
+    """
+    It skins several SMPL sequences with a pool of processes
+
+    Args:
+      sequences: a list of `SMPLSequence` (or objects with poses/trans/beta/gender)
+      workers: number of processes. Defaults to the number of cpus
+      chunk_frames: frames of one task. Defaults to 512
+      batch_size: SMPL batch size inside a task. Defaults to 128
+      dtype: dtype of the vertices. Defaults to np.float32
+      mp_context: multiprocessing start method, 'spawn' is safe with torch threads
+
+    Returns:
+      A list of (N, 6890, 3) arrays in shared memory, one per sequence.
+    """
+    workers = os.cpu_count() if workers is None else workers
+    outputs, blocks = [], []
+    for seq in sequences:
+        out, shm = _shared_array((len(seq.poses), 6890, 3), dtype)
+        outputs.append(out)
+        blocks.append(shm)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=mp.get_context(mp_context),
+                                 initializer=_init_worker,
+                                 initargs=(1,)) as executor:
+            futures = []
+            for seq, out, shm in zip(sequences, outputs, blocks):
+                n = len(seq.poses)
+                beta = np.asarray(seq.beta, dtype=np.float32)
+                frame_beta = beta.ndim == 2 and beta.shape[0] == n
+                for lb in range(0, n, chunk_frames):
+                    ub = min(lb + chunk_frames, n)
+                    futures.append(executor.submit(
+                        _skin_chunk, shm.name, out.shape, out.dtype, lb,
+                        np.asarray(seq.poses[lb:ub]),
+                        None if seq.trans is None else np.asarray(seq.trans[lb:ub]),
+                        beta[lb:ub] if frame_beta else beta,
+                        seq.gender, batch_size))
+            for future in futures:
+                future.result()
+    finally:
+        # the name is released, the mapping lives on with the arrays
+        for shm in blocks:
+            shm.unlink()
+    return outputs
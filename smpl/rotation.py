@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized rotation conversions between axis-angle (..., 3), quaternion (..., 4)
+as (w, x, y, z), 6D (..., 6) as the first two columns of the matrix, and rotation
+matrices (..., 3, 3).
+
+Every function accepts a torch.Tensor or a np.ndarray, batched over all the leading
+dimensions, and returns the same type.
+"""
+import numpy as np
+import torch
+
+
+def _is_torch(x):
+    return isinstance(x, torch.Tensor)
+
+
+def _norm(x):
+    if _is_torch(x):
+        return torch.norm(x, p=2, dim=-1, keepdim=True)
+    return np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def _stack(xs, axis=-1):
+    if _is_torch(xs[0]):
+        return torch.stack(xs, dim=axis)
+    return np.stack(xs, axis=axis)
+
+
+def _cat(xs, axis=-1):
+    if _is_torch(xs[0]):
+        return torch.cat(xs, dim=axis)
+    return np.concatenate(xs, axis=axis)
+
+
+def _cos(x):
+    return torch.cos(x) if _is_torch(x) else np.cos(x)
+
+
+def _sin(x):
+    return torch.sin(x) if _is_torch(x) else np.sin(x)
+
+
+def _sqrt(x):
+    return torch.sqrt(x) if _is_torch(x) else np.sqrt(x)
+
+
+def _atan2(y, x):
+    return torch.atan2(y, x) if _is_torch(y) else np.arctan2(y, x)
+
+
+def _cross(a, b):
+    return torch.cross(a, b, dim=-1) if _is_torch(a) else np.cross(a, b)
+
+
+def _where(cond, x, y):
+    if _is_torch(x):
+        return torch.where(cond, x, y)
+    return np.where(cond, x, y)
+
+
+def axis_angle_to_matrix(axis_angle):
+    """
+    Rodrigues' formula in one pass, (..., 3) --> (..., 3, 3)
+    """
+    angle = _norm(axis_angle + 1e-8)
+    x, y, z = [(axis_angle / angle)[..., i] for i in range(3)]
+    c, s = _cos(angle[..., 0]), _sin(angle[..., 0])
+    t = 1 - c
+
+    rotmat = _stack([c + x * x * t, x * y * t - z * s, x * z * t + y * s,
+                     y * x * t + z * s, c + y * y * t, y * z * t - x * s,
+                     z * x * t - y * s, z * y * t + x * s, c + z * z * t], axis=-1)
+    return rotmat.reshape(tuple(axis_angle.shape[:-1]) + (3, 3))
+
+
+def axis_angle_to_quaternion(axis_angle):
+    """
+    (..., 3) --> (..., 4) as (w, x, y, z)
+    """
+    angle = _norm(axis_angle + 1e-8)
+    half = angle * 0.5
+    return _cat([_cos(half), _sin(half) * axis_angle / angle], axis=-1)
+
+
+def quaternion_to_matrix(quat):
+    """
+    (..., 4) as (w, x, y, z) --> (..., 3, 3), the quaternion is normalized first
+    """
+    quat = quat / _norm(quat)
+    w, x, y, z = [quat[..., i] for i in range(4)]
+
+    w2, x2, y2, z2 = w * w, x * x, y * y, z * z
+    wx, wy, wz = w * x, w * y, w * z
+    xy, xz, yz = x * y, x * z, y * z
+
+    rotmat = _stack([w2 + x2 - y2 - z2, 2 * xy - 2 * wz, 2 * wy + 2 * xz,
+                     2 * wz + 2 * xy, w2 - x2 + y2 - z2, 2 * yz - 2 * wx,
+                     2 * xz - 2 * wy, 2 * wx + 2 * yz, w2 - x2 - y2 + z2], axis=-1)
+    return rotmat.reshape(tuple(quat.shape[:-1]) + (3, 3))
+
+
+def matrix_to_quaternion(rotmat):
+    """
+    (..., 3, 3) --> (..., 4) as (w, x, y, z) with w >= 0, using for every matrix the
+    best conditioned of the four candidate solutions
+    """
+    m = [[rotmat[..., i, j] for j in range(3)] for i in range(3)]
+    diag = _stack([1 + m[0][0] + m[1][1] + m[2][2],
+                   1 + m[0][0] - m[1][1] - m[2][2],
+                   1 - m[0][0] + m[1][1] - m[2][2],
+                   1 - m[0][0] - m[1][1] + m[2][2]], axis=-1)
+    candidates = _stack([
+        _stack([diag[..., 0], m[2][1] - m[1][2], m[0][2] - m[2][0], m[1][0] - m[0][1]], axis=-1),
+        _stack([m[2][1] - m[1][2], diag[..., 1], m[1][0] + m[0][1], m[0][2] + m[2][0]], axis=-1),
+        _stack([m[0][2] - m[2][0], m[1][0] + m[0][1], diag[..., 2], m[1][2] + m[2][1]], axis=-1),
+        _stack([m[1][0] - m[0][1], m[2][0] + m[0][2], m[2][1] + m[1][2], diag[..., 3]], axis=-1),
+    ], axis=-2)
+
+    if _is_torch(rotmat):
+        best = diag.argmax(dim=-1, keepdim=True)
+        quat = torch.gather(candidates, -2, best[..., None].expand(best.shape + (4,)))[..., 0, :]
+        scale = 2 * torch.sqrt(torch.gather(diag, -1, best).clamp(min=1e-12))
+        sign = torch.where(quat[..., :1] < 0, -torch.ones_like(scale), torch.ones_like(scale))
+    else:
+        best = diag.argmax(axis=-1)[..., None]
+        quat = np.take_along_axis(candidates, best[..., None], axis=-2)[..., 0, :]
+        scale = 2 * np.sqrt(np.maximum(np.take_along_axis(diag, best, axis=-1), 1e-12))
+        sign = np.where(quat[..., :1] < 0, -1.0, 1.0)
+    return quat / scale * sign
+
+
+def quaternion_to_axis_angle(quat):
+    """
+    (..., 4) as (w, x, y, z) --> (..., 3), the angle is in [0, pi]
+    """
+    quat = quat / _norm(quat)
+    quat = _where(quat[..., :1] < 0, -quat, quat)
+    sin_half = _norm(quat[..., 1:])
+    angle = 2 * _atan2(sin_half, quat[..., :1])
+    small = sin_half < 1e-8
+    # angle / sin(angle / 2) --> 2 when the angle vanishes
+    ratio = _where(small, 2 + 0 * angle, angle / _where(small, 1 + 0 * sin_half, sin_half))
+    return quat[..., 1:] * ratio
+
+
+def matrix_to_axis_angle(rotmat):
+    """
+    (..., 3, 3) --> (..., 3)
+    """
+    return quaternion_to_axis_angle(matrix_to_quaternion(rotmat))
+
+
+def rotation_6d_to_matrix(rot6d):
+    """
+    (..., 6) --> (..., 3, 3) by Gram-Schmidt, the 6D vector holds the first two columns
+    """
+    a1, a2 = rot6d[..., :3], rot6d[..., 3:]
+    b1 = a1 / _norm(a1)
+    b2 = a2 - (b1 * a2).sum(-1)[..., None] * b1
+    b2 = b2 / _norm(b2)
+    b3 = _cross(b1, b2)
+    return _stack([b1, b2, b3], axis=-1)
+
+
+def matrix_to_rotation_6d(rotmat):
+    """
+    (..., 3, 3) --> (..., 6)
+    """
+    return _cat([rotmat[..., :, 0], rotmat[..., :, 1]], axis=-1)
+
+
+def rodrigues(theta):
+    """Convert axis-angle representation to rotation matrix.
+    Args:
+        theta: size = [B, 3]
+    Returns:
+        Rotation matrix corresponding to the axis-angle -- size = [B, 3, 3]
+    """
+    return axis_angle_to_matrix(theta)
+
+
+def quat2mat(quat):
+    """Convert quaternion coefficients to rotation matrix.
+    Args:
+        quat: size = [B, 4] 4 <===>(w, x, y, z)
+    Returns:
+        Rotation matrix corresponding to the quaternion -- size = [B, 3, 3]
+    """
+    return quaternion_to_matrix(quat)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Compiled CPU runtimes of the SMPL model
+
+    eager:   the plain nn.Module
+    script:  TorchScript, traced and frozen (the forward is trace-friendly, see SMPL.forward)
+    compile: torch.compile (PyTorch >= 2.0)
+
+Compiled runtimes run on static shapes: the batch is padded to `batch_size`, so a
+whole sequence runs on one graph.
+"""
+import os
+import threading
+
+import torch
+
+RUNTIME_MODES = ['eager', 'script', 'compile']
+
+
+def in_graph_capture():
+    """ True while the SMPL forward is traced, scripted or compiled """
+    if torch.jit.is_tracing() or torch.jit.is_scripting():
+        return True
+    compiler = getattr(torch, 'compiler', None)
+    return bool(compiler is not None and hasattr(compiler, 'is_compiling') and compiler.is_compiling())
+
+
+def configure_cpu_runtime(threads=None, interop_threads=None, cpus=None):
+    """
+    It sets the intra-op / inter-op threads of torch and optionally pins the process to `cpus`
+
+    Args:
+      threads: intra-op threads, None keeps the torch default
+      interop_threads: inter-op threads, only settable before any parallel work
+      cpus: a list of cpu ids to pin the process to (Linux only)
+    """
+    if cpus is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    if threads is not None:
+        torch.set_num_threads(threads)
+    if interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            print(f'[WARNING] inter-op threads not set: {e}')
+
+
+class CompiledSMPL(object):
+    """
+    A callable `(pose, beta) -> vertices` running a SMPL model in `mode`
+
+    Args:
+      smpl: the SMPL model
+      mode: 'eager', 'script' or 'compile'
+      batch_size: the static batch size of the compiled graphs
+    """
+
+    def __init__(self, smpl, mode='eager', batch_size=1024):
+        if mode not in RUNTIME_MODES:
+            raise ValueError(f'Unknown SMPL runtime: {mode}, choose from {RUNTIME_MODES}')
+        if mode == 'compile' and not hasattr(torch, 'compile'):
+            print('[WARNING] torch.compile needs PyTorch >= 2.0, SMPL runs in eager mode')
+            mode = 'eager'
+        self.smpl = smpl.eval()
+        self.mode = mode
+        self.batch_size = batch_size
+        self._graphs = {}
+        self._lock = threading.Lock()
+
+    def _graph(self, pose, beta):
+        # one graph per pose layout and per shared / per-frame beta
+        key = (pose.ndimension(), beta.shape[0] == 1)
+        with self._lock:
+            if key not in self._graphs:
+                if self.mode == 'script':
+                    with torch.no_grad():
+                        traced = torch.jit.trace(self.smpl, (pose, beta), check_trace=False)
+                    self._graphs[key] = torch.jit.freeze(traced)
+                else:
+                    self._graphs[key] = torch.compile(self.smpl, dynamic=False)
+            return self._graphs[key]
+
+    def __call__(self, pose, beta):
+        if self.mode == 'eager':
+            return self.smpl(pose, beta)
+
+        beta = beta.view(-1, 10)
+        outputs = []
+        for lb in range(0, pose.shape[0], self.batch_size):
+            cur_pose = pose[lb:lb + self.batch_size]
+            cur_beta = beta if beta.shape[0] == 1 else beta[lb:lb + self.batch_size]
+            n = cur_pose.shape[0]
+            if n < self.batch_size:
+                cur_pose = torch.cat([cur_pose, cur_pose[-1:].expand((self.batch_size - n,) + cur_pose.shape[1:])])
+                if cur_beta.shape[0] > 1:
+                    cur_beta = torch.cat([cur_beta, cur_beta[-1:].expand(self.batch_size - n, -1)])
+            with torch.no_grad():
+                outputs.append(self._graph(cur_pose, cur_beta)(cur_pose, cur_beta)[:n])
+        return outputs[0] if len(outputs) == 1 else torch.cat(outputs)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+A SMPL sequence skinned on demand
+
+Only pose/trans/beta are kept, the vertices of a frame are skinned when they are
+first requested, in chunks of frames, and kept in a bounded LRU cache. The chunks
+ahead of the playback direction are skinned in a background thread.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from smpl.smpl import poses_to_vertices, poses_to_joints, update_vertices, edited_joints
+
+_PREFETCH_EXECUTOR = None
+_PREFETCH_LOCK = threading.Lock()
+
+
+def _prefetch_executor():
+    global _PREFETCH_EXECUTOR
+    with _PREFETCH_LOCK:
+        if _PREFETCH_EXECUTOR is None:
+            _PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smpl_prefetch')
+        return _PREFETCH_EXECUTOR
+
+
+class SkinnedVertices(np.ndarray):
+    """
+    (N, 6890, 3) vertices carrying the (N, 24, 3) joints of their poses, by forward
+    kinematics as `SMPLSequence.joints`
+    """
+
+    def __array_finalize__(self, obj):
+        joints = getattr(obj, '_joints', None)
+        # a view keeps the joints while its frames are those of the joints,
+        # `__getitem__` slices them with the frames
+        if joints is not None and (self.ndim != 3 or self.shape[0] != joints.shape[0]):
+            joints = None
+        self._joints = joints
+
+    def __getitem__(self, index):
+        vertices = super(SkinnedVertices, self).__getitem__(index)
+        if isinstance(vertices, SkinnedVertices) and self._joints is not None:
+            frames = index[0] if isinstance(index, tuple) and index else index
+            if (isinstance(index, tuple) and not index) or frames is Ellipsis or frames is None:
+                vertices._joints = self._joints if vertices.shape[:1] == self.shape[:1] else None
+            else:
+                vertices._joints = self._joints[frames]
+        return vertices
+
+    def joints(self, index=None):
+        """ The joints, (N, 24, 3) or (24, 3) for one frame, or (..., 3) of joint `index` """
+        if self._joints is None:
+            raise ValueError('the joints of these vertices are unknown, index the frames of the sequence instead')
+        joints = np.asarray(self._joints)
+        return joints if index is None else joints[..., index, :]
+
+
+def skinned_vertices(vertices, joints):
+    """ The `SkinnedVertices` view of `vertices` with their `joints` """
+    vertices = np.asarray(vertices).view(SkinnedVertices)
+    vertices._joints = joints
+    return vertices
+
+
+class SMPLSequence(object):
+    """
+    Array-like (N, 6890, 3) vertices of a SMPL sequence, `seq[i]` skins frame i lazily
+
+    Args:
+      poses: (N, 72) or (N, 24, 3, 3)
+      trans: (N, 3) or None
+      beta: (10, ) or (N, 10)
+      gender: 'male' or 'female'
+      chunk_size: frames skinned together on a cache miss. Defaults to 32
+      cache_frames: max number of frames kept in memory. Defaults to 512
+      prefetch: chunks skinned ahead of the playback direction. Defaults to 2
+      storage_dtype: dtype of the cached vertices. With np.float16 the cache holds the
+        vertices before translation (body-sized values keep ~1 mm precision) and the
+        float32 translation is added per frame. Defaults to np.float32
+    """
+
+    def __init__(self, poses, trans=None, beta=[0] * 10, gender='male',
+                 chunk_size=32, cache_frames=512, prefetch=2, storage_dtype=np.float32):
+        self.poses = poses
+        self.trans = trans
+        self.beta = np.asarray(beta, dtype=np.float32)
+        self.gender = gender
+        self.chunk_size = chunk_size
+        self.cache_chunks = max(1, cache_frames // chunk_size)
+        self.prefetch = prefetch
+        self.storage_dtype = np.dtype(storage_dtype)
+        # half precision cannot hold world coordinates, cache body-local vertices
+        self._local = self.storage_dtype.itemsize < 4
+
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_index = 0
+        self._direction = 1
+
+    def __len__(self):
+        return len(self.poses)
+
+    @property
+    def shape(self):
+        return (len(self), 6890, 3)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    @property
+    def n_chunks(self):
+        return (len(self) + self.chunk_size - 1) // self.chunk_size
+
+    def _frame_beta(self, lb, ub):
+        if self.beta.ndim == 2 and self.beta.shape[0] == len(self):
+            return self.beta[lb:ub]
+        return self.beta
+
+    def _skin_chunk(self, chunk):
+        lb = chunk * self.chunk_size
+        ub = min(lb + self.chunk_size, len(self))
+        return poses_to_vertices(self.poses[lb:ub],
+                                 None if self.trans is None or self._local else self.trans[lb:ub],
+                                 beta=self._frame_beta(lb, ub),
+                                 batch_size=self.chunk_size,
+                                 gender=self.gender,
+                                 dtype=self.storage_dtype)
+
+    def _store(self, chunk, vertices):
+        with self._lock:
+            self._cache[chunk] = vertices
+            self._cache.move_to_end(chunk)
+            while len(self._cache) > self.cache_chunks:
+                self._cache.popitem(last=False)
+
+    def _get_chunk(self, chunk):
+        with self._lock:
+            if chunk in self._cache:
+                self._cache.move_to_end(chunk)
+                return self._cache[chunk]
+            future = self._pending.get(chunk)
+        if future is not None:
+            return future.result()
+        vertices = self._skin_chunk(chunk)
+        self._store(chunk, vertices)
+        return vertices
+
+    def _prefetch_chunk(self, chunk):
+        try:
+            vertices = self._skin_chunk(chunk)
+            self._store(chunk, vertices)
+            return vertices
+        finally:
+            with self._lock:
+                self._pending.pop(chunk, None)
+
+    def _follow(self, index):
+        """ It tracks the playback direction and queues the chunks ahead of it """
+        if index != self._last_index:
+            self._direction = 1 if index > self._last_index else -1
+        self._last_index = index
+
+        chunk = index // self.chunk_size
+        for k in range(1, self.prefetch + 1):
+            c = chunk + k * self._direction
+            if c < 0 or c >= self.n_chunks:
+                break
+            with self._lock:
+                if c in self._cache or c in self._pending:
+                    continue
+                self._pending[c] = _prefetch_executor().submit(self._prefetch_chunk, c)
+
+    def frame(self, index):
+        """ The vertices (6890, 3) of frame `index`, without prefetching """
+        chunk = index // self.chunk_size
+        vertices = self._get_chunk(chunk)[index - chunk * self.chunk_size]
+        if self._local:
+            vertices = vertices.astype(np.float32)
+            if self.trans is not None:
+                vertices += np.asarray(self.trans[index], dtype=np.float32)
+        return vertices
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = int(index)
+            if index < 0:
+                index += len(self)
+            if index < 0 or index >= len(self):
+                raise IndexError(f'frame {index} out of range of {len(self)} frames')
+            vertices = self.frame(index)
+            self._follow(index)
+            return vertices
+        if isinstance(index, slice):
+            return np.stack([self.frame(i) for i in range(*index.indices(len(self)))])
+        return np.asarray(self)[index]
+
+    def __array__(self, dtype=None):
+        vertices = poses_to_vertices(self.poses, self.trans, beta=self.beta, gender=self.gender)
+        return vertices if dtype is None else vertices.astype(dtype, copy=False)
+
+    def with_trans(self, trans):
+        """ The same poses and shape moved along another translation """
+        return SMPLSequence(self.poses, trans, self.beta, self.gender,
+                            chunk_size=self.chunk_size,
+                            cache_frames=self.cache_chunks * self.chunk_size,
+                            prefetch=self.prefetch,
+                            storage_dtype=self.storage_dtype)
+
+    def joints(self, index=None):
+        """
+        The joints of the whole sequence by forward kinematics, no vertex is skinned
+
+        Returns:
+          (N, 24, 3), or (N, 3) of joint `index`
+        """
+        joints = poses_to_joints(self.poses, self.trans, beta=self.beta, gender=self.gender)
+        return joints if index is None else joints[:, index]
+
+    def update_pose(self, index, pose, joints=None):
+        """
+        It edits the pose of frame `index` and patches its cached vertices in place, only
+        the vertices moved by the edited joints are skinned again
+
+        Args:
+          index: the frame
+          pose: the new pose, (72, ) or (24, 3, 3)
+          joints: the edited joints, None to find them by comparing with the old pose
+        """
+        if joints is None:
+            joints = edited_joints(self.poses[index], pose)
+        self.poses[index] = pose
+        if not joints:
+            return
+
+        chunk = index // self.chunk_size
+        with self._lock:
+            future = self._pending.get(chunk)
+        if future is not None:
+            # a chunk being skinned may have read the old pose
+            future.result()
+        with self._lock:
+            if chunk not in self._cache:
+                return
+            lb = chunk * self.chunk_size
+            ub = min(lb + self.chunk_size, len(self))
+            update_vertices(self._cache[chunk], self.poses[lb:ub], [index - lb],
+                            trans=None if self.trans is None or self._local else self.trans[lb:ub],
+                            beta=self._frame_beta(lb, ub),
+                            gender=self.gender,
+                            joints=joints)
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
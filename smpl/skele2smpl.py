@@ -7,15 +7,14 @@
 ________________________,--._(___Y___)_,--._______________________
                         `--'           `--'
 '''
-from .smpl import SMPL
+from .smpl import iter_poses_to_vertices
+from .generate_ply import MeshSequenceWriter
+from .rotation import matrix_to_axis_angle
 
 import numpy as np
 import argparse
-from .generate_ply import save_ply
-import math
 import os
 import pandas as pd
-import torch
 import sys
 from pathlib import Path
 
@@ -42,110 +41,124 @@ SMPL
 '''
 
 
-def get_x_rot_mat(theta):
-    res = np.eye(3)
-    cos_theta = math.cos(theta)
-    sin_theta = math.sin(theta)
-    res[1, 1] = cos_theta
-    res[1, 2] = -sin_theta
-    res[2, 1] = sin_theta
-    res[2, 2] = cos_theta
+SMPL_TO_IMU = ['Hips', 'LeftUpLeg', 'RightUpLeg', 'Spine', 'LeftLeg',
+               'RightLeg', 'Spine1', 'LeftFoot', 'RightFoot', 'Spine2',
+               'LeftFootEnd', 'RightFootEnd', 'Neck', 'LeftShoulder',
+               'RightShoulder', 'Head', 'LeftArm', 'RightArm',
+               'LeftForeArm', 'RightForeArm', 'LeftHand', 'RightHand',
+               'LeftHandThumb2', 'RightHandThumb2']
+
+# z offsets (radians) bringing the shoulders and arms of the mocap rest pose to SMPL
+Z_OFFSETS = {'LeftShoulder': -0.3, 'RightShoulder': 0.3, 'LeftArm': 0.3, 'RightArm': -0.3}
+
+# mocap -> lidar coordinates
+MOCAP_INIT = np.array([
+    [-1, 0, 0],
+    [0, 0, 1],
+    [0, 1, 0]])
+
+
+def _rot_mat(theta, i, j):
+    theta = np.asarray(theta, dtype=np.float64)
+    res = np.zeros(theta.shape + (3, 3))
+    res[..., [0, 1, 2], [0, 1, 2]] = 1
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    res[..., i, i] = cos_theta
+    res[..., i, j] = -sin_theta
+    res[..., j, i] = sin_theta
+    res[..., j, j] = cos_theta
     return res
 
 
+def get_x_rot_mat(theta):
+    """ (...) radians --> (..., 3, 3) """
+    return _rot_mat(theta, 1, 2)
+
+
 def get_y_rot_mat(theta):
-    res = np.eye(3)
-    cos_theta = math.cos(theta)
-    sin_theta = math.sin(theta)
-    res[0, 0] = cos_theta
-    res[0, 2] = sin_theta
-    res[2, 0] = -sin_theta
-    res[2, 2] = cos_theta
-    return res
+    """ (...) radians --> (..., 3, 3) """
+    return _rot_mat(theta, 2, 0)
 
 
 def get_z_rot_mat(theta):
-    res = np.eye(3)
-    cos_theta = math.cos(theta)
-    sin_theta = math.sin(theta)
-    res[0, 0] = cos_theta
-    res[0, 1] = -sin_theta
-    res[1, 0] = sin_theta
-    res[1, 1] = cos_theta
-    return res
+    """ (...) radians --> (..., 3, 3) """
+    return _rot_mat(theta, 0, 1)
+
+
+def euler_columns(rotation_df, converter_version=True):
+    """
+    It reads the X/Y/Z Euler columns of the 24 SMPL joints as one array
+
+    Args:
+      rotation_df: the rotation dataframe of the bvh (csv)
+      converter_version: columns named 'Joint.X' (bvh-converter), otherwise 'Joint.x'
+        and the missing joints are kept at zero
+
+    Returns:
+      (N, 24, 3) x/y/z rotations in radians
+    """
+    axes = ['X', 'Y', 'Z'] if converter_version else ['x', 'y', 'z']
+    euler = np.zeros((len(rotation_df), len(SMPL_TO_IMU), 3))
+    for j, each in enumerate(SMPL_TO_IMU):
+        cols = [f'{each}.{a}' for a in axes]
+        if converter_version or cols[0] in rotation_df.columns:
+            euler[:, j] = rotation_df[cols].to_numpy(dtype=np.float64)
+    euler = np.radians(euler)
+    for each, offset in Z_OFFSETS.items():
+        euler[:, SMPL_TO_IMU.index(each), 2] += offset
+    return euler
+
+
+def get_poses_from_bvh(rotation_df, converter_version=True):
+    """
+    It converts every frame of the bvh rotations to SMPL poses at once, the joint
+    rotations are Y * X * Z
+
+    Returns:
+      (N, 72) axis-angle poses
+    """
+    euler = euler_columns(rotation_df, converter_version)
+    rotmat = get_y_rot_mat(euler[..., 1]) @ get_x_rot_mat(euler[..., 0]) @ get_z_rot_mat(euler[..., 2])
+    return matrix_to_axis_angle(rotmat).reshape(len(rotation_df), -1)
 
 
-def rotmat_to_axis_angle(rotmat, return_angle=False):
-    angle = math.acos((rotmat[0, 0] + rotmat[1, 1] + rotmat[2, 2] - 1) / 2)
-    vec = [rotmat[2, 1] - rotmat[1, 2], rotmat[0, 2] -
-           rotmat[2, 0], rotmat[1, 0] - rotmat[0, 1]]
-    norm = np.linalg.norm(vec)
-    if abs(norm) < 1e-8:
-        norm = 1.0
-    for i in range(3):
-        vec[i] /= norm
-    if return_angle:
-        return np.array([vec, angle])
-    for i in range(3):
-        vec[i] *= angle
-    return np.array(vec)
+def get_pose_from_bvh(rotation_df, idx=0, converter_version=True):
+    """ The (72, ) pose of frame `idx`, see `get_poses_from_bvh` """
+    return get_poses_from_bvh(rotation_df.loc[[idx]], converter_version)[0]
 
 
-def get_pose_from_bvh(rotation_df, idx=0, converter_version=True):
-    smpl_to_imu = ['Hips', 'LeftUpLeg', 'RightUpLeg', 'Spine', 'LeftLeg',
-                   'RightLeg', 'Spine1', 'LeftFoot', 'RightFoot', 'Spine2',
-                   'LeftFootEnd', 'RightFootEnd', 'Neck', 'LeftShoulder',
-                   'RightShoulder', 'Head', 'LeftArm', 'RightArm',
-                   'LeftForeArm', 'RightForeArm', 'LeftHand', 'RightHand',
-                   'LeftHandThumb2', 'RightHandThumb2']
-    pose = []
-    import pandas as pd
-    for each in smpl_to_imu:
-        if converter_version:
-            xrot = math.radians(rotation_df.at[idx, each + '.X'])
-            yrot = math.radians(rotation_df.at[idx, each + '.Y'])
-            zrot = math.radians(rotation_df.at[idx, each + '.Z'])
-        else:
-            xrot = 0
-            yrot = 0
-            zrot = 0
-            if each + '.x' in rotation_df.columns:
-                xrot = math.radians(rotation_df.at[idx, each + '.x'])
-                yrot = math.radians(rotation_df.at[idx, each + '.y'])
-                zrot = math.radians(rotation_df.at[idx, each + '.z'])
-        if each == 'LeftShoulder':
-            zrot -= 0.3 
-        elif each == 'RightShoulder':
-            zrot += 0.3
-        elif each == 'LeftArm':
-            zrot += 0.3 
-        elif each == 'RightArm':
-            zrot -= 0.3
-        rotmat = np.eye(3)
-        rotmat = np.dot(rotmat, get_y_rot_mat(yrot))
-        rotmat = np.dot(rotmat, get_x_rot_mat(xrot))
-        rotmat = np.dot(rotmat, get_z_rot_mat(zrot))
-        pose.append(rotmat)
-    for i in range(len(pose)):
-        pose[i] = rotmat_to_axis_angle(pose[i])
-    pose = np.stack(pose).flatten()
-    return pose  # return rotation matrix
+def bvh_to_mesh_sequence(rotation_df, translation, out_file, converter_version=False, batch_size=1024):
+    """
+    It converts a bvh sequence to SMPL and streams its meshes, in the lidar
+    coordinates, into a .smplseq file
+
+    Args:
+      rotation_df: the rotation dataframe of the bvh (csv)
+      translation: (N, 3) root translations in the lidar coordinates
+      out_file: the .smplseq file
+
+    Returns:
+      The (N, 72) poses.
+    """
+    n = len(translation)
+    trans = np.asarray(translation, dtype=np.float32)
+    poses = get_poses_from_bvh(rotation_df.iloc[:n], converter_version)
+    mocap_init = MOCAP_INIT.T.astype(np.float32)
+    with MeshSequenceWriter(out_file) as writer:
+        for lb, ub, vertices in iter_poses_to_vertices(poses, batch_size=batch_size):
+            writer.write(vertices @ mocap_init + trans[lb:ub, None])
+    return poses
 
 
 def main():
     rotation_df = pd.read_csv(args.bvh_name + '_rotations.csv')
     worldpos_df = pd.read_csv(args.bvh_name + '_worldpos.csv')
+    rows = list(range(1059, 1658, 3))
+    poses = get_poses_from_bvh(rotation_df.loc[rows])
+    hips = worldpos_df.loc[rows, ['Hips.X', 'Hips.Y', 'Hips.Z']].to_numpy()
     with open('pose.txt', 'w') as f:
-        for i in range(1059, 1658, 3):
-            s = str((i - 1056) // 3)
-            s += ' ' + str(worldpos_df.at[i, 'Hips.X'])
-            s += ' ' + str(worldpos_df.at[i, 'Hips.Y'])
-            s += ' ' + str(worldpos_df.at[i, 'Hips.Z'])
-            cur_pose = get_pose_from_bvh(rotation_df, i)
-            for each in cur_pose:
-                s += ' ' + str(each)
-            s += '\n'
-            f.write(s)
+        for i, hip, pose in zip(rows, hips, poses):
+            f.write(' '.join([str((i - 1056) // 3)] + [str(v) for v in hip] + [str(v) for v in pose]) + '\n')
 
 
 if __name__ == '__main__':
@@ -177,22 +190,11 @@ if __name__ == '__main__':
 
     rotation_df = pd.read_csv(rotpath)
     lidar = np.loadtxt(lidar_file, dtype=float)
-    with open(lidar_file) as f:
-        lines = f.readlines()
-    n = min(len(rotation_df), len(lines))
-    smpl = SMPL()
-    
-    # mocap->lidar坐标系
-    mocap_init = np.array([
-        [-1, 0, 0],
-        [0, 0, 1], 
-        [0, 1, 0]])
-
-    for i in range(min(lidar.shape[0], len(rotation_df))):
-        vertices = smpl(torch.from_numpy(get_pose_from_bvh(
-            rotation_df, i, False)).unsqueeze(0).float(), torch.zeros((1, 10)))
-        vertices = vertices.squeeze().cpu().numpy()
-        translation = lidar[i, 1:4]
-        vertices = np.matmul(mocap_init, vertices.T).T + translation
-        save_ply(vertices, os.path.join(smpl_out_dir, str(i) + '_smpl.ply'))
-    print('SMPL saved in: ', smpl_out_dir)
\ No newline at end of file
+    n = min(lidar.shape[0], len(rotation_df))
+
+    trans = lidar[:n, 1:4].astype(np.float32)
+    out_file = os.path.join(smpl_out_dir, Path(rotpath).stem + '_smpl.smplseq')
+    poses = bvh_to_mesh_sequence(rotation_df, trans, out_file)
+    np.savez(os.path.join(smpl_out_dir, Path(rotpath).stem + '_smpl.npz'),
+             pose=poses.astype(np.float32), trans=trans)
+    print('SMPL saved in: ', out_file)
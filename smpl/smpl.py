@@ -12,101 +12,64 @@ import torch
 import torch.nn as nn
 import numpy as np
 import os
-# try:
-#     import cPickle as pickle
-# except ImportError:
-import pickle
+import threading
 
 import smpl.config as cfg
+from smpl.model_file import load_smpl_model
+from smpl.rotation import axis_angle_to_matrix, rodrigues, quat2mat
+from smpl.runtime import CompiledSMPL, in_graph_capture
 
-def quat2mat(quat):
-    """Convert quaternion coefficients to rotation matrix.
-    Args:
-        quat: size = [B, 4] 4 <===>(w, x, y, z)
-    Returns:
-        Rotation matrix corresponding to the quaternion -- size = [B, 3, 3]
-    """
-    norm_quat = quat
-    norm_quat = norm_quat / norm_quat.norm(p=2, dim=1, keepdim=True)
-    w, x, y, z = norm_quat[:, 0], norm_quat[:,
-                                            1], norm_quat[:, 2], norm_quat[:, 3]
-
-    B = quat.size(0)
-
-    w2, x2, y2, z2 = w.pow(2), x.pow(2), y.pow(2), z.pow(2)
-    wx, wy, wz = w * x, w * y, w * z
-    xy, xz, yz = x * y, x * z, y * z
-
-    rotMat = torch.stack([w2 + x2 - y2 - z2, 2 * xy - 2 * wz, 2 * wy + 2 * xz,
-                          2 * wz + 2 * xy, w2 - x2 + y2 - z2, 2 * yz - 2 * wx,
-                          2 * xz - 2 * wy, 2 * wx + 2 * yz, w2 - x2 - y2 + z2],
-                         dim=1).view(B, 3, 3)
-    return rotMat
-
-def rodrigues(theta):
-    """Convert axis-angle representation to rotation matrix.
-    Args:
-        theta: size = [B, 3]
-    Returns:
-        Rotation matrix corresponding to the quaternion -- size = [B, 3, 3]
-    """
-    l1norm = torch.norm(theta + 1e-8, p=2, dim=1)
-    angle = torch.unsqueeze(l1norm, -1)
-    normalized = torch.div(theta, angle)
-    angle = angle * 0.5
-    v_cos = torch.cos(angle)
-    v_sin = torch.sin(angle)
-    quat = torch.cat([v_cos, v_sin * normalized], dim=1)
-    return quat2mat(quat)
 
 class SMPL(nn.Module):
 
-    def __init__(self, gender='male'):
+    def __init__(self, gender='male', lbs_topk=None, sparse_lbs=True):
         """
         Args:
             center_idx: index of center joint in our computations,
             model_file: path to pkl files for the model
             gender: 'neutral' (default) or 'female' or 'male'
+            lbs_topk: joints blended per vertex, None keeps every non-zero weight
+            sparse_lbs: skin with the top-k weights instead of the dense weights
         """
         super(SMPL, self).__init__()
-        if gender == 'male':
-            model_file = os.path.join(os.path.dirname(__file__), "SMPL_male_V1.pkl")
-        elif gender == 'female':
-            model_file = os.path.join(os.path.dirname(__file__), "SMPL_female_V1.pkl")
-        else:
-            raise ValueError('Unknown gender: %s' % gender)
-        
-        with open(model_file, 'rb') as f:
-            smpl_model = pickle.load(f, encoding='iso-8859-1')
-        J_regressor = smpl_model['J_regressor'].tocoo()
-
-        row = J_regressor.row
-        col = J_regressor.col
-        data = J_regressor.data
-
-        i = torch.LongTensor(np.array([row, col]))
-        v = torch.FloatTensor(data)
-        J_regressor_shape = [24, 6890]
-        self.register_buffer('J_regressor', torch.sparse.FloatTensor(i, v,
-                                                                     J_regressor_shape).to_dense())
-        self.register_buffer(
-            'weights', torch.FloatTensor(smpl_model['weights']))
-        self.register_buffer(
-            'posedirs', torch.FloatTensor(smpl_model['posedirs']))
-        self.register_buffer(
-            'v_template', torch.FloatTensor(smpl_model['v_template']))
-        self.register_buffer('shapedirs',
-                             torch.FloatTensor(np.array(smpl_model['shapedirs'])))
-        self.register_buffer('faces',
-                             torch.from_numpy(smpl_model['f'].astype(np.int64)))
-        self.register_buffer('kintree_table', torch.from_numpy(
-            smpl_model['kintree_table'].astype(np.int64)))
+        smpl_model = load_smpl_model(gender)
+
+        self.register_buffer('J_regressor', torch.from_numpy(smpl_model['J_regressor']))
+        # only a few hundred vertices contribute to the joints, keep those columns
+        # so the joint regression is one small batched matmul
+        J_regressor_cols = np.nonzero(smpl_model['J_regressor'].any(axis=0))[0]
+        self.register_buffer('J_regressor_cols', torch.from_numpy(J_regressor_cols.astype(np.int64)))
+        self.register_buffer('J_regressor_reduced', self.J_regressor[:, self.J_regressor_cols].contiguous())
+        self.register_buffer('weights', torch.from_numpy(smpl_model['weights']))
+        self.register_buffer('posedirs', torch.from_numpy(smpl_model['posedirs']))
+        self.register_buffer('v_template', torch.from_numpy(smpl_model['v_template']))
+        self.register_buffer('shapedirs', torch.from_numpy(smpl_model['shapedirs']))
+        self.register_buffer('faces', torch.from_numpy(smpl_model['faces']))
+        self.register_buffer('kintree_table', torch.from_numpy(smpl_model['kintree_table']))
         id_to_col = {self.kintree_table[1, i].item(): i for i in
                      range(self.kintree_table.shape[1])}
         self.register_buffer('parent', torch.LongTensor(
             [id_to_col[self.kintree_table[0, it].item()] for it in
              range(1, self.kintree_table.shape[1])]))
 
+        # depth levels of the kinematic tree, joints sorted by depth and
+        # kin_levels holding the [start, end) of every level in kin_order
+        parent = self.parent.tolist()
+        depth = [0]
+        for i in range(1, len(parent) + 1):
+            depth.append(depth[parent[i - 1]] + 1)
+        kin_order = sorted(range(1, len(depth)), key=lambda j: (depth[j], j))
+        self.register_buffer('kin_order', torch.LongTensor(kin_order))
+        self.register_buffer('kin_order_parent', torch.LongTensor(
+            [parent[j - 1] for j in kin_order]))
+        self.kin_levels = []
+        for d in range(1, max(depth) + 1):
+            level = [k for k, j in enumerate(kin_order) if depth[j] == d]
+            self.kin_levels.append((level[0], level[-1] + 1))
+
+        self.register_buffer('I_cube', torch.eye(3)[None, None])
+        self.register_buffer('pad_row', torch.FloatTensor([0, 0, 0, 1]))
+
         self.pose_shape = [24, 3]
         self.beta_shape = [10]
         self.translation_shape = [3]
@@ -119,57 +82,96 @@ class SMPL(nn.Module):
         self.J = None
         self.R = None
 
-        J_regressor_extra = torch.from_numpy(
-            np.load(cfg.JOINT_REGRESSOR_TRAIN_EXTRA)).float()
-        self.register_buffer('J_regressor_extra', J_regressor_extra)
+        self.register_buffer('J_regressor_extra', torch.from_numpy(smpl_model['J_regressor_extra']))
         self.joints_idx = cfg.JOINTS_IDX
+
+        # a vertex is driven by at most a handful of joints, keep their indices and
+        # weights (renormalized if truncated) for the sparse skinning
+        max_nnz = int((self.weights > 0).sum(dim=1).max())
+        self.lbs_topk = max_nnz if lbs_topk is None else min(lbs_topk, max_nnz)
+        lbs_weights, lbs_joints = torch.topk(self.weights, self.lbs_topk, dim=1)
+        if self.lbs_topk < max_nnz:
+            lbs_weights = lbs_weights / lbs_weights.sum(dim=1, keepdim=True)
+        self.register_buffer('lbs_weights', lbs_weights.contiguous())
+        self.register_buffer('lbs_joints', lbs_joints.contiguous())
+        self.sparse_lbs = sparse_lbs
+        self._rest_shape_cache = None
+        self._subset_cache = {}
+
+        # rest joints as a linear function of beta, for the joint-only forward kinematics
+        self.register_buffer('J_template', torch.matmul(self.J_regressor, self.v_template))
+        self.register_buffer('J_shapedirs', torch.einsum('ji,ikl->jkl', self.J_regressor, self.shapedirs))
         self.requires_grad_(False)
 
     def forward(self, pose, beta):  # return vertices location
-        device = pose.device
+        """
+        Input:
+            pose: size = (B, 72) or (B, 24, 3, 3)
+            beta: size = (B, 10), or (1, 10) / (10, ) for a shape shared by the batch
+        Output:
+            vertices: size = (B, 6890, 3)
+        """
         batch_size = pose.shape[0]
-        v_template = self.v_template[None, :]
-        shapedirs = self.shapedirs.view(-1,
-                                        10)[None, :].expand(batch_size, -1, -1)
-        beta = beta[:, :, None]
-        v_shaped = torch.matmul(shapedirs, beta).view(-1, 6890, 3) + v_template
-        # batched sparse matmul not supported in pytorch
-        J = []
-        for i in range(batch_size):
-            J.append(torch.matmul(self.J_regressor, v_shaped[i]))
-        J = torch.stack(J, dim=0)
-        # input it rotmat: (bs,24,3,3)
-        if pose.ndimension() == 4:
-            R = pose
-        # input it rotmat: (bs,72)
-        elif pose.ndimension() == 2:
-            pose_cube = pose.view(-1, 3)  # (batch_size * 24, 1, 3)
-            R = rodrigues(pose_cube).view(batch_size, 24, 3, 3)
-            R = R.view(batch_size, 24, 3, 3)
-        I_cube = torch.eye(3)[None, None, :].to(device)
-        # I_cube = torch.eye(3)[None, None, :].expand(theta.shape[0], R.shape[1]-1, -1, -1)
-        lrotmin = (R[:, 1:, :] - I_cube).view(batch_size, -1)
+        if beta.ndimension() == 1 or beta.shape[0] == 1:
+            # the python-side cache is skipped while tracing/compiling the graph
+            v_shaped, J = self.rest_shape(beta.view(1, -1), cached=not in_graph_capture())
+        else:
+            v_template = self.v_template[None, :]
+            shapedirs = self.shapedirs.view(-1,
+                                            10)[None, :].expand(batch_size, -1, -1)
+            beta = beta[:, :, None]
+            v_shaped = torch.matmul(shapedirs, beta).view(-1, 6890, 3) + v_template
+            J = self.regress_joints(v_shaped)
+        R = self.pose_to_rotmat(pose)
+        lrotmin = (R[:, 1:, :] - self.I_cube).view(batch_size, -1)
         posedirs = self.posedirs.view(-1,
                                       207)[None, :].expand(batch_size, -1, -1)
         v_posed = v_shaped + torch.matmul(posedirs, lrotmin[:, :, None]).view(-1, 6890,
                                                                               3)
-        J_ = J.clone()
-        J_[:, 1:, :] = J[:, 1:, :] - J[:, self.parent, :]
-        G_ = torch.cat([R, J_[:, :, :, None]], dim=-1)
-        pad_row = torch.FloatTensor([0, 0, 0, 1]).to(device).view(1, 1, 1, 4).expand(
-            batch_size, 24, -1, -1)
-        G_ = torch.cat([G_, pad_row], dim=2)
-        G = [G_[:, 0].clone()]
-        for i in range(1, 24):
-            G.append(torch.matmul(G[self.parent[i - 1]], G_[:, i, :, :]))
-        G = torch.stack(G, dim=1)
-
-        rest = torch.cat([J, torch.zeros(batch_size, 24, 1).to(device)], dim=2).view(
-            batch_size, 24, 4, 1)
-        zeros = torch.zeros(batch_size, 24, 4, 3).to(device)
-        rest = torch.cat([zeros, rest], dim=-1)
-        rest = torch.matmul(G, rest)
-        G = G - rest
+        G = self.kinematic_chain(R, J)
+        # remove the rest pose: G[:, :, :, 3] -= G[:, :, :, :3] @ (J, 0)
+        G[:, :, :3, 3] -= torch.matmul(G[:, :, :3, :3], J[:, :, :, None])[..., 0]
+        if self.sparse_lbs:
+            return self.lbs_sparse(G, v_posed)
+        return self.lbs_dense(G, v_posed)
+
+    def pose_to_rotmat(self, pose):
+        # input it rotmat: (bs,24,3,3)
+        if pose.ndimension() == 4:
+            return pose
+        # input it axis-angle: (bs,72)
+        return axis_angle_to_matrix(pose.view(pose.shape[0], 24, 3))
+
+    def joints_only(self, pose, beta, trans=None):
+        """
+        Forward kinematics of the 24 joints without skinning the mesh. The joints are
+        the kinematic ones, they differ from `get_full_joints` of the skinned mesh only
+        by the pose-corrective offsets (a few millimeters)
+        Input:
+            pose: size = (B, 72) or (B, 24, 3, 3)
+            beta: size = (B, 10), or (1, 10) / (10, ) for a shape shared by the batch
+            trans: size = (B, 3) or None
+        Output:
+            3D joints: size = (B, 24, 3)
+        """
+        beta = beta.view(-1, 10)
+        J = self.J_template[None] + torch.matmul(self.J_shapedirs, beta.t()).permute(2, 0, 1)
+        G = self.kinematic_chain(self.pose_to_rotmat(pose), J)
+        joints = G[:, :, :3, 3]
+        if trans is not None:
+            joints = joints + trans[:, None, :]
+        return joints
+
+    def lbs_dense(self, G, v_posed):
+        """
+        Linear blend skinning with the full (6890, 24) weights
+        Input:
+            G: skinning transforms, size = (B, 24, 4, 4)
+            v_posed: size = (B, 6890, 3)
+        Output:
+            vertices: size = (B, 6890, 3)
+        """
+        batch_size = G.shape[0]
         T = torch.matmul(self.weights,
                          G.permute(1, 0, 2, 3).contiguous().view(24, -1)).view(6890,
                                                                                batch_size,
@@ -181,6 +183,173 @@ class SMPL(nn.Module):
         v = torch.matmul(T, rest_shape_h[:, :, :, None])[:, :, :3, 0]
         return v
 
+    def lbs_sparse(self, G, v_posed):
+        """
+        Linear blend skinning with the top-k joints of every vertex, only the (3, 4)
+        affine part of the transforms is blended and no homogeneous padding is built
+        Input:
+            G: skinning transforms, size = (B, 24, 4, 4)
+            v_posed: size = (B, 6890, 3)
+        Output:
+            vertices: size = (B, 6890, 3)
+        """
+        A = G[:, :, :3]
+        T = A[:, self.lbs_joints[:, 0]] * self.lbs_weights[:, 0, None, None]
+        for k in range(1, self.lbs_topk):
+            T.add_(A[:, self.lbs_joints[:, k]] * self.lbs_weights[:, k, None, None])
+        v = torch.matmul(T[..., :3], v_posed[..., None])[..., 0]
+        return v.add_(T[..., 3])
+
+    def rest_shape(self, beta, cached=True):
+        """
+        The shaped template and its rest joints of a single shape, the last one is
+        cached so a sequence with a constant beta computes them only once
+        Input:
+            beta: size = (1, 10)
+        Output:
+            v_shaped: size = (1, 6890, 3), J: size = (1, 24, 3)
+        """
+        if cached:
+            key = (beta.device, beta.dtype, beta.detach().cpu().numpy().tobytes())
+            cache = self._rest_shape_cache
+            if cache is not None and cache[0] == key:
+                return cache[1], cache[2]
+
+        v_shaped = torch.matmul(self.shapedirs.view(-1, 10), beta[0]).view(1, 6890, 3) + self.v_template[None]
+        J = self.regress_joints(v_shaped)
+        if cached:
+            self._rest_shape_cache = (key, v_shaped, J)
+        return v_shaped, J
+
+    def kinematic_chain(self, R, J):
+        """
+        Compose the global joint transforms level by level along the kinematic tree,
+        all joints at the same depth are solved with one batched matmul
+        Input:
+            R: local joint rotations, size = (B, 24, 3, 3)
+            J: rest joint locations, size = (B, 24, 3)
+        Output:
+            global transforms: size = (B, 24, 4, 4), G[:, :, :3, 3] are the posed joints
+        """
+        batch_size = R.shape[0]
+        G_ = R.new_empty(batch_size, 24, 4, 4)
+        G_[:, :, :3, :3] = R
+        G_[:, 0, :3, 3] = J[:, 0]
+        G_[:, 1:, :3, 3] = J[:, 1:] - J[:, self.parent]
+        G_[:, :, 3] = self.pad_row
+
+        G = torch.empty_like(G_)
+        G[:, 0] = G_[:, 0]
+        for start, end in self.kin_levels:
+            joints = self.kin_order[start:end]
+            parents = self.kin_order_parent[start:end]
+            G[:, joints] = torch.matmul(G[:, parents], G_[:, joints])
+        return G
+
+    def skinning_subset(self, joints, posedirs_tol=1e-6):
+        """
+        The vertices moved when the local rotations of `joints` change: the ones weighted
+        by a joint of their subtrees, and the ones whose pose correctives of `joints`
+        exceed `posedirs_tol`. Also the transforms skinning them, level by level
+        Input:
+            joints: the edited joints
+        Output:
+            vertex indices: size = (V, ),
+            [(joints, parents)] per depth level of the joints whose transforms are needed
+        """
+        key = (tuple(sorted(set(int(j) for j in joints))), posedirs_tol)
+        if key in self._subset_cache:
+            return self._subset_cache[key]
+
+        parent = [-1] + self.parent.tolist()
+        children = [[] for _ in parent]
+        for j in range(1, len(parent)):
+            children[parent[j]].append(j)
+        subtree, stack = set(), list(key[0])
+        while stack:
+            j = stack.pop()
+            if j not in subtree:
+                subtree.add(j)
+                stack.extend(children[j])
+
+        moved = (self.weights[:, sorted(subtree)] > 0).any(dim=1)
+        pose_joints = [j for j in key[0] if j > 0]
+        if pose_joints:
+            cols = torch.cat([torch.arange(9 * (j - 1), 9 * j) for j in pose_joints])
+            moved |= (self.posedirs[:, :, cols].abs() > posedirs_tol).flatten(1).any(dim=1)
+        vertices = torch.nonzero(moved)[:, 0]
+
+        # the moved vertices are blended from joints outside the subtree too
+        needed = set()
+        for j in self.lbs_joints[vertices][self.lbs_weights[vertices] > 0].unique().tolist():
+            while j >= 0 and j not in needed:
+                needed.add(j)
+                j = parent[j]
+        levels = []
+        for start, end in self.kin_levels:
+            level = [k for k in range(start, end) if self.kin_order[k].item() in needed]
+            if level:
+                levels.append((self.kin_order[level], self.kin_order_parent[level]))
+
+        self._subset_cache[key] = (vertices, levels)
+        return vertices, levels
+
+    def forward_subset(self, pose, beta, joints, posedirs_tol=1e-6):
+        """
+        The vertices of `forward` moved by an edit of the local rotations of `joints`,
+        only the transforms skinning them are composed and only they are skinned
+        Input:
+            pose: the edited poses, size = (B, 72) or (B, 24, 3, 3)
+            beta: size = (B, 10), or (1, 10) / (10, ) for a shape shared by the batch
+            joints: the edited joints
+        Output:
+            vertex indices: size = (V, ), vertices: size = (B, V, 3)
+        """
+        vertices, levels = self.skinning_subset(joints, posedirs_tol)
+        batch_size = pose.shape[0]
+        beta = beta.view(-1, 10)
+        if beta.shape[0] == 1:
+            v_shaped, J = self.rest_shape(beta)
+            v_shaped = v_shaped[:, vertices]
+        else:
+            v_shaped = torch.matmul(self.shapedirs[vertices], beta.t()).permute(2, 0, 1) + self.v_template[vertices]
+            J = self.J_template[None] + torch.matmul(self.J_shapedirs, beta.t()).permute(2, 0, 1)
+        J = J.expand(batch_size, -1, -1)
+
+        R = self.pose_to_rotmat(pose)
+        lrotmin = (R[:, 1:, :] - self.I_cube).view(batch_size, -1)
+        v_posed = v_shaped + torch.matmul(self.posedirs[vertices].view(-1, 207),
+                                          lrotmin.t()).view(-1, 3, batch_size).permute(2, 0, 1)
+
+        G_ = R.new_zeros(batch_size, 24, 4, 4)
+        G_[:, :, :3, :3] = R
+        G_[:, 0, :3, 3] = J[:, 0]
+        G_[:, 1:, :3, 3] = J[:, 1:] - J[:, self.parent]
+        G_[:, :, 3] = self.pad_row
+        G = torch.zeros_like(G_)
+        G[:, 0] = G_[:, 0]
+        for level_joints, level_parents in levels:
+            G[:, level_joints] = torch.matmul(G[:, level_parents], G_[:, level_joints])
+        G[:, :, :3, 3] -= torch.matmul(G[:, :, :3, :3], J[:, :, :, None])[..., 0]
+
+        A = G[:, :, :3]
+        lbs_joints, lbs_weights = self.lbs_joints[vertices], self.lbs_weights[vertices]
+        T = A[:, lbs_joints[:, 0]] * lbs_weights[:, 0, None, None]
+        for k in range(1, self.lbs_topk):
+            T.add_(A[:, lbs_joints[:, k]] * lbs_weights[:, k, None, None])
+        v = torch.matmul(T[..., :3], v_posed[..., None])[..., 0]
+        return vertices, v.add_(T[..., 3])
+
+    def regress_joints(self, vertices):
+        """
+        Batched joint regression over the non-zero columns of J_regressor
+        Input:
+            vertices: size = (B, 6890, 3)
+        Output:
+            3D joints: size = (B, 24, 3)
+        """
+        return torch.matmul(self.J_regressor_reduced, vertices[:, self.J_regressor_cols])
+
     def get_full_joints(self, vertices):
         """
         This method is used to get the joint locations from the SMPL mesh
@@ -197,6 +366,69 @@ class SMPL(nn.Module):
         return joints[:, leaf_indexes, :]
 
 
+_SMPL_MODELS = {}
+_SMPL_MODELS_LOCK = threading.Lock()
+
+
+def get_smpl(gender='male', dtype=torch.float32, device='cpu'):
+    """
+    It returns the process-wide SMPL model of (gender, dtype, device), the model
+    is loaded on the first request and shared by all later callers
+    
+    Args:
+      gender: 'male' or 'female'
+      dtype: floating point type of the model buffers. Defaults to torch.float32
+      device: the device of the model. Defaults to 'cpu'
+    
+    Returns:
+      A SMPL instance, it must be treated as read-only.
+    """
+    key = (gender, dtype, torch.device(device))
+    with _SMPL_MODELS_LOCK:
+        if key not in _SMPL_MODELS:
+            _SMPL_MODELS[key] = SMPL(gender=gender).to(device=key[2], dtype=dtype)
+        return _SMPL_MODELS[key]
+
+
+def get_smpl_runtime(gender='male', mode=None, batch_size=1024):
+    """
+    It returns the shared `CompiledSMPL` runtime of the cpu float32 model of `gender`
+    
+    Args:
+      gender: 'male' or 'female'
+      mode: 'eager', 'script' or 'compile'. Defaults to `cfg.SMPL_RUNTIME`
+      batch_size: the static batch size of the compiled graphs
+    """
+    mode = cfg.SMPL_RUNTIME if mode is None else mode
+    smpl = get_smpl(gender=gender)
+    key = ('runtime', gender, mode, batch_size)
+    with _SMPL_MODELS_LOCK:
+        if key not in _SMPL_MODELS:
+            _SMPL_MODELS[key] = CompiledSMPL(smpl, mode=mode, batch_size=batch_size)
+        return _SMPL_MODELS[key]
+
+
+def evict_smpl(gender=None, dtype=None, device=None):
+    """
+    It drops the cached SMPL models matching the given keys, None matches everything
+    
+    Returns:
+      The number of evicted models.
+    """
+    device = None if device is None else torch.device(device)
+    with _SMPL_MODELS_LOCK:
+        keys = [k for k in _SMPL_MODELS if k[0] != 'runtime' and
+                (gender is None or k[0] == gender) and
+                (dtype is None or k[1] == dtype) and
+                (device is None or k[2] == device)]
+        # the runtimes hold the model of their gender
+        keys += [k for k in _SMPL_MODELS if k[0] == 'runtime' and
+                 any(k[1] == m[0] for m in keys)]
+        for k in keys:
+            del _SMPL_MODELS[k]
+    return len(keys)
+
+
 def get_smpl_vertices(trans: torch.Tensor,
                       poses: torch.Tensor,
                       shapes: torch.Tensor,
@@ -252,42 +484,142 @@ def append_alpha(imtmp):
     return im_RGBA
 
 
-def poses_to_vertices(poses, trans=None, beta = [0] * 10, batch_size = 1024, gender='male'):
+def _frame_betas(beta, n):
     """
-    It takes in a batch of poses and returns a batch of vertices
+    It returns the betas of n frames as float32, or a single (1, 10) beta when the
+    shape is constant over the sequence so SMPL computes its blend shapes once
+    """
+    beta = np.asarray(beta, dtype=np.float32)
+    if beta.ndim == 2 and beta.shape[0] == n and n > 1:
+        if (beta != beta[:1]).any():
+            return beta
+        return beta[:1]
+    return beta.reshape(1, -1)
+
+
+def poses_to_joints(poses, trans=None, beta = [0] * 10, batch_size = 8192, gender='male'):
+    """
+    The joint-only counterpart of `poses_to_vertices`, by forward kinematics without skinning
     
     Args:
-      poses: the pose parameters of the SMPL model. (N, 72, 3) or (N, 24, 3, 3)
+      poses: the pose parameters of the SMPL model. (N, 72) or (N, 24, 3, 3)
       trans: translation of the model (N, 3)
-      beta: the shape parameters of the SMPL model. (10, )
-      batch_size: the number of poses to process at once. Defaults to 1024
+      beta: the shape parameters of the SMPL model. (10, ) or (N, 10)
+      batch_size: the number of poses to process at once. Defaults to 8192
     
     Returns:
-      The vertices of the mesh.
+      The float32 joints (N, 24, 3).
     """
+    n = len(poses)
+    beta = _frame_betas(beta, n)
+    smpl = get_smpl(gender=gender)
+    joints = np.empty((n, 24, 3), dtype=np.float32)
 
+    for lb in range(0, n, batch_size):
+        ub = min(lb + batch_size, n)
+        cur_poses = torch.from_numpy(np.ascontiguousarray(poses[lb:ub], dtype=np.float32))
+        cur_beta = torch.from_numpy(np.ascontiguousarray(beta if len(beta) == 1 else beta[lb:ub]))
+        cur_trans = None if trans is None else torch.from_numpy(np.asarray(trans[lb:ub], dtype=np.float32))
+        joints[lb:ub] = smpl.joints_only(cur_poses, cur_beta, cur_trans).cpu().numpy()
+    return joints
+
+
+def _skin_batches(poses, beta, batch_size, gender):
     n = len(poses)
-    beta = np.array(beta)
-    # if not (beta != 0).sum():
-    #     beta = np.array([ 0.13718624, -0.32368565,  0.06066366,  0.22490674, -0.3380233 ,
-    #                       -0.1569234,  0.32280767, -0.00115923, -0.04938826,  0.04286334])
-    if beta.shape[0] != poses.shape[0] or len(beta.shape) != len(poses.shape):
-        beta = beta.squeeze()[None, :].repeat(n, axis=0).astype(np.float32)
-
-    poses = poses.astype(np.float32)
-    vertices = np.zeros((0, 6890, 3))
-
-    smpl = SMPL(gender=gender)
-    n_batch = (n + batch_size - 1) // batch_size
-
-    for i in range(n_batch):
-        lb = i * batch_size
-        ub = (i + 1) * batch_size
-        ub = min(ub, n)
-        cur_vertices = smpl(torch.from_numpy(poses[lb:ub]), torch.from_numpy(beta[lb:ub]))
-        vertices = np.concatenate((vertices, cur_vertices.cpu().numpy()))
+    beta = _frame_betas(beta, n)
+    smpl = get_smpl_runtime(gender=gender, batch_size=batch_size)
+
+    for lb in range(0, n, batch_size):
+        ub = min(lb + batch_size, n)
+        cur_poses = torch.from_numpy(np.ascontiguousarray(poses[lb:ub], dtype=np.float32))
+        cur_beta = torch.from_numpy(np.ascontiguousarray(beta if len(beta) == 1 else beta[lb:ub]))
+        yield lb, ub, smpl(cur_poses, cur_beta).cpu().numpy()
+
 
+def iter_poses_to_vertices(poses, trans=None, beta = [0] * 10, batch_size = 1024, gender='male'):
+    """
+    The streaming version of `poses_to_vertices`, only one batch of vertices is alive at a time
+    
+    Args:
+      poses: the pose parameters of the SMPL model. (N, 72) or (N, 24, 3, 3)
+      trans: translation of the model (N, 3)
+      beta: the shape parameters of the SMPL model. (10, ) or (N, 10)
+      batch_size: the number of poses to process at once. Defaults to 1024
+    
+    Yields:
+      (lb, ub, vertices), the float32 vertices (ub - lb, 6890, 3) of the frames [lb, ub)
+    """
+    for lb, ub, vertices in _skin_batches(poses, beta, batch_size, gender):
+        if trans is not None:
+            vertices += np.asarray(trans[lb:ub], dtype=np.float32)[:, None, :]
+        yield lb, ub, vertices
+
+
+def edited_joints(old_pose, new_pose):
+    """
+    The joints whose local rotation differs between two poses, (72, ) or (24, 3, 3)
+    """
+    old_pose = np.asarray(old_pose).reshape(24, -1)
+    new_pose = np.asarray(new_pose).reshape(24, -1)
+    return np.nonzero((old_pose != new_pose).any(axis=1))[0].tolist()
+
+
+def update_vertices(vertices, poses, frames, trans=None, beta = [0] * 10, gender='male', joints=None, posedirs_tol=1e-6):
+    """
+    It updates in place the vertices of `frames` after an edit of their poses, only the
+    vertices moved by the edited joints are skinned again
+    
+    Args:
+      vertices: the (N, 6890, 3) vertices of the sequence, written in place
+      poses: the edited pose parameters of the whole sequence. (N, 72) or (N, 24, 3, 3)
+      frames: the edited frames
+      trans: translation of the model (N, 3), None if `vertices` are not translated
+      beta: the shape parameters of the SMPL model. (10, ) or (N, 10)
+      joints: the edited joints, None for all of them
+      posedirs_tol: pose correctives below it are not updated, see `SMPL.skinning_subset`
+    
+    Returns:
+      The vertex indices which were updated.
+    """
+    frames = np.atleast_1d(np.asarray(frames, dtype=np.int64))
+    joints = list(range(24)) if joints is None else joints
+    beta = _frame_betas(beta, len(poses))
+    smpl = get_smpl(gender=gender)
+
+    cur_poses = torch.from_numpy(np.ascontiguousarray(np.asarray(poses)[frames], dtype=np.float32))
+    cur_beta = torch.from_numpy(np.ascontiguousarray(beta if len(beta) == 1 else beta[frames]))
+    with torch.no_grad():
+        index, verts = smpl.forward_subset(cur_poses, cur_beta, joints, posedirs_tol)
+    index, verts = index.numpy(), verts.numpy()
     if trans is not None:
-        trans = trans.astype(np.float32)
-        vertices += np.expand_dims(trans, 1)
-    return vertices
+        verts += np.asarray(trans, dtype=np.float32)[frames][:, None, :]
+    vertices[frames[:, None], index[None, :]] = verts.astype(vertices.dtype, copy=False)
+    return index
+
+
+def poses_to_vertices(poses, trans=None, beta = [0] * 10, batch_size = 1024, gender='male', out=None, dtype=np.float32):
+    """
+    It takes in a batch of poses and returns a batch of vertices
+    
+    Args:
+      poses: the pose parameters of the SMPL model. (N, 72) or (N, 24, 3, 3)
+      trans: translation of the model (N, 3)
+      beta: the shape parameters of the SMPL model. (10, ) or (N, 10)
+      batch_size: the number of poses to process at once. Defaults to 1024
+      out: a preallocated (N, 6890, 3) array to write into, e.g. a np.memmap
+      dtype: the dtype of the returned array when `out` is None. Defaults to np.float32
+    
+    Returns:
+      The vertices of the mesh.
+    """
+    n = len(poses)
+    if out is None:
+        out = np.empty((n, 6890, 3), dtype=dtype)
+    elif out.shape != (n, 6890, 3):
+        raise ValueError(f'out should be of shape {(n, 6890, 3)}, got {out.shape}')
+
+    for lb, ub, vertices in _skin_batches(poses, beta, batch_size, gender):
+        if trans is not None:
+            vertices += np.asarray(trans[lb:ub], dtype=np.float32)[:, None, :]
+        out[lb:ub] = vertices
+    return out
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of skinned SMPL sequences
+
+The vertices (N, 6890, 3) and forward kinematics joints (N, 24, 3) of a sequence are stored
+as float32 .npy files named after a hash of pose/trans/beta/gender and of the model
+version, a second load of the same sequence only memory-maps them. The least
+recently used entries are evicted to stay under `max_bytes`.
+"""
+import os
+import hashlib
+import threading
+
+import numpy as np
+
+import smpl.config as cfg
+from smpl.smpl import poses_to_vertices, poses_to_joints
+from smpl.sequence import SkinnedVertices
+
+# bump when the skinning or the joints change the output
+CACHE_VERSION = 3
+
+
+def model_version(gender):
+    """ A string changing with the SMPL model file of `gender` """
+    model_file = cfg.SMPL_MODEL_FILES.get(gender, '')
+    if os.path.isfile(model_file):
+        stat = os.stat(model_file)
+        return f'{CACHE_VERSION}-{stat.st_size}-{int(stat.st_mtime)}'
+    return f'{CACHE_VERSION}-{gender}'
+
+
+def sequence_key(poses, trans, beta, gender):
+    """
+    It hashes the content of a SMPL sequence
+
+    Returns:
+      A hex digest, the file name of the cache entry
+    """
+    h = hashlib.sha1()
+    for array in (poses, trans, beta):
+        if array is None:
+            h.update(b'none')
+            continue
+        array = np.ascontiguousarray(array, dtype=np.float32)
+        h.update(str(array.shape).encode())
+        h.update(array.tobytes())
+    h.update(str(gender).encode())
+    h.update(model_version(gender).encode())
+    return h.hexdigest()
+
+
+class CachedVertices(SkinnedVertices):
+    """ Memory-mapped `SkinnedVertices`, both read from the cache files """
+
+
+class VertexCache(object):
+    """
+    A size-bounded directory of skinned SMPL sequences
+
+    Args:
+      cache_dir: the cache folder. Defaults to `cfg.SMPL_CACHE_DIR`
+      max_bytes: the cache is kept under this size. Defaults to `cfg.SMPL_CACHE_MAX_BYTES`
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cfg.SMPL_CACHE_DIR if cache_dir is None else cache_dir
+        self.max_bytes = cfg.SMPL_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _paths(self, key):
+        return (os.path.join(self.cache_dir, key + '.vertices.npy'),
+                os.path.join(self.cache_dir, key + '.joints.npy'))
+
+    def get(self, key):
+        """
+        Returns:
+          The `CachedVertices` of `key`, or None on a miss
+        """
+        vert_path, joint_path = self._paths(key)
+        try:
+            vertices = np.load(vert_path, mmap_mode='r')
+            joints = np.load(joint_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        # the mtime is the recency of the LRU eviction
+        os.utime(vert_path)
+        os.utime(joint_path)
+        vertices = vertices.view(CachedVertices)
+        vertices._joints = joints
+        return vertices
+
+    def put(self, key, poses, trans=None, beta=[0] * 10, gender='male', batch_size=1024):
+        """
+        It skins the sequence straight into the cache files
+
+        Returns:
+          The `CachedVertices` of `key`
+        """
+        n = len(poses)
+        self.evict(n * (6890 + 24) * 3 * 4)
+
+        vert_path, joint_path = self._paths(key)
+        # write aside and swap, a reader never sees a half-written entry
+        tmp_vert = vert_path + f'.{os.getpid()}.tmp'
+        tmp_joint = joint_path + f'.{os.getpid()}.tmp'
+        vertices = np.lib.format.open_memmap(tmp_vert, mode='w+', dtype=np.float32, shape=(n, 6890, 3))
+        joints = np.lib.format.open_memmap(tmp_joint, mode='w+', dtype=np.float32, shape=(n, 24, 3))
+        poses_to_vertices(poses, trans, beta=beta, batch_size=batch_size, gender=gender, out=vertices)
+        joints[:] = poses_to_joints(poses, trans, beta=beta, gender=gender)
+        vertices.flush()
+        joints.flush()
+        del vertices, joints
+        os.replace(tmp_joint, joint_path)
+        os.replace(tmp_vert, vert_path)
+        return self.get(key)
+
+    def entries(self):
+        """ [(mtime, bytes, key)] of the complete entries, oldest first """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.vertices.npy'):
+                continue
+            key = name[:-len('.vertices.npy')]
+            try:
+                size = sum(os.path.getsize(p) for p in self._paths(key))
+                mtime = os.path.getmtime(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((mtime, size, key))
+        return sorted(entries)
+
+    def evict(self, incoming=0):
+        """ It removes the least recently used entries until `incoming` more bytes fit """
+        with self._lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total + incoming <= self.max_bytes:
+                    break
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+
+    def clear(self):
+        with self._lock:
+            for _, _, key in self.entries():
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+def cached_poses_to_vertices(poses, trans=None, beta=[0] * 10, gender='male', cache=None, batch_size=1024):
+    """
+    `poses_to_vertices` through a `VertexCache`, the sequence is only skinned on a miss
+
+    Args:
+      cache: a `VertexCache`, a cache folder, or None for the default cache
+
+    Returns:
+      `CachedVertices` (N, 6890, 3) memory-mapped float32, with `.joints(index)`
+    """
+    if not isinstance(cache, VertexCache):
+        cache = VertexCache(cache)
+    key = sequence_key(poses, trans, beta, gender)
+    vertices = cache.get(key)
+    if vertices is None:
+        vertices = cache.put(key, poses, trans, beta, gender, batch_size)
+    return vertices
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import gc
+import subprocess
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from smpl.pool import _shared_array
+
+
+def test_mapping_closed_after_last_view():
+    vertices, shm = _shared_array((4, 6890, 3), 'float32')
+    shm.unlink()
+    mapping = shm._mmap
+    view = vertices[1:3]
+    del vertices, shm
+    gc.collect()
+    assert not mapping.closed
+    del view
+    gc.collect()
+    assert mapping.closed
+
+
+def test_exit_holding_pooled_array():
+    code = textwrap.dedent('''
+        from smpl.pool import _shared_array
+        vertices, shm = _shared_array((4, 6890, 3), 'float32')
+        shm.unlink()
+        vertices[:] = 1
+        view = vertices[1:3]
+    ''')
+    result = subprocess.run([sys.executable, '-W', 'ignore::DeprecationWarning', '-c', code],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stderr == ''
@@ -1,6 +1,6 @@
 from .icp_smpl_point import icp_mesh_and_point
-from .load_data import Data_loader, read_pcd_from_server, list_dir_remote, load_scene, client_server
+from .load_data import Data_loader, read_pcd_from_server, list_dir_remote, load_scene, client_server, intensity_to_colors
 from .viewpoint import make_cloud_in_vis_center, generate_views, get_head_global_rots
-from .tool_func import images_to_video, read_json_file, cam_to_extrinsic, extrinsic_to_cam, plot_kpt_on_img, get_2d_keypoints
+from .tool_func import images_to_video, read_json_file, cam_to_extrinsic, extrinsic_to_cam, plot_kpt_on_img, get_2d_keypoints, transform_points, load_txt
 from . import pypcd
 from .o3dvis import o3dvis
@@ -9,7 +9,7 @@ import matplotlib.pyplot as plt
 sys.path.append('.')
 sys.path.append('..')
 
-from util import read_json_file
+from util import read_json_file, transform_points
 
 def save_json_file(file_name, save_dict):
     """
@@ -64,18 +64,11 @@ def calibration(points2d, points3d, intrinsic, dist):
     return extrinsic, proj_err
 
 def world_to_camera(X, extrinsic_matrix):
-    n = X.shape[0]
-    X = np.concatenate((X, np.ones((n, 1))), axis=-1).T
-    X = np.dot(extrinsic_matrix, X).T
-    return X[..., :3]
+    return transform_points(X, extrinsic_matrix)
 
 
 def camera_to_world(X, extrinsic_matrix):
-    matrix = np.linalg.inv(extrinsic_matrix)
-    n = X.shape[0]
-    X = np.concatenate((X, np.ones((n, 1))), axis=-1).T
-    X = np.dot(matrix, X).T
-    return X[..., :3]
+    return transform_points(X, np.linalg.inv(extrinsic_matrix))
 
 def camera_to_pixel(X, intrinsic_matrix, distortion_coefficients=np.zeros(5)):
     # focal length
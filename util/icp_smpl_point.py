@@ -21,11 +21,11 @@ import sys
 
 sys.path.append(".")
 sys.path.append("..")
-from smpl import SMPL
+from smpl import get_smpl
 
 def vertices_to_root(vertices, index = 0):
-    smpl = SMPL()
-    return smpl.get_full_joints(torch.FloatTensor(vertices))[..., index, :]
+    smpl = get_smpl()
+    return smpl.regress_joints(torch.FloatTensor(vertices))[..., index, :]
 
 def hidden_point_removal(pcd, camera_location = [0, 0, 0]):
     dist = np.linalg.norm(pcd.get_center())
@@ -23,9 +23,12 @@ import shutil
 import paramiko
 import torch
 import cv2
+import functools
 
 from util import pypcd
-from smpl.smpl import SMPL
+from util.tool_func import transform_points, load_txt
+from smpl.smpl import poses_to_vertices
+from smpl.generate_ply import smpl_faces
 
 view = {
 	"trajectory" : 
@@ -81,7 +84,10 @@ def list_dir_remote(client, folder):
     res_list = stdout.readlines()
     return [i.strip() for i in res_list]
 
-def read_pcd_from_server(client, filepath, sftp_client = None):
+# the PCD fields rendered by Data_loader.load_point_cloud, the other ones are not read
+RENDERED_PCD_FIELDS = ['x', 'y', 'z', 'rgb', 'normal_x', 'normal_y', 'normal_z', 'intensity']
+
+def read_pcd_from_server(client, filepath, sftp_client = None, fields = None):
     """
     It reads a pcd file from a remote server and returns a numpy array
     
@@ -89,6 +95,7 @@ def read_pcd_from_server(client, filepath, sftp_client = None):
       client: the ssh client
       filepath: the path to the file on the server
       sftp_client: the sftp client that you use to connect to the server.
+      fields: the PCD fields to read. Defaults to all of them
     
     Returns:
       a numpy array of the point cloud data.
@@ -98,41 +105,96 @@ def read_pcd_from_server(client, filepath, sftp_client = None):
     remote_file = sftp_client.open(filepath, mode='rb')  # 文件路径
 
     try:
-        pc_pcd = pypcd.PointCloud.from_fileobj(remote_file)
+        pc_pcd = pypcd.PointCloud.from_fileobj(remote_file, fields)
         return read_pcd(pc_pcd)
     except Exception as e:
         print(f"Load point cloud {filepath} error")
     finally:
         remote_file.close()
 
+@functools.lru_cache(maxsize=None)
+def colormap_lut(cmap='plasma', n=256):
+    """
+    It samples a matplotlib colormap once into a lookup table
+    
+    Args:
+      cmap: the name of the colormap
+      n: the number of entries
+    
+    Returns:
+      A read-only float64 (n, 3) rgb table, entry i colors the values in [i / n, (i + 1) / n).
+    """
+    lut = plt.get_cmap(cmap, n)(np.arange(n))[:, :3]
+    lut.setflags(write=False)
+    return lut
+
+def intensity_to_colors(intensity, cmap='plasma'):
+    """
+    It maps the intensity of the points to the colors of `cmap`, by indexing its lookup table
+    
+    Args:
+      intensity: (N, ) or (N, 1) intensity, in [0, 1] or in [0, 255]. Intensity above
+        255 is first compressed by 155 * log2(i / 100) / log2(864) + 100 beyond 100
+      cmap: the name of the colormap
+    
+    Returns:
+      A float64 (N, 3) array of rgb colors.
+    """
+    intensity = np.asarray(intensity, dtype=np.float32).reshape(-1)
+    if len(intensity) == 0:
+        return np.zeros((0, 3))
+    if intensity.max() > 255:
+        high = intensity > 100
+        intensity = intensity.copy()
+        intensity[high] = 155 * np.log2(intensity[high] / 100) / np.log2(864) + 100
+    scale = 1 if intensity.max() < 1.1 else 255
+    lut = colormap_lut(cmap)
+    # the same binning as a matplotlib colormap of len(lut) colors
+    index = np.nan_to_num(intensity * (len(lut) / scale))
+    index = np.clip(index, 0, len(lut) - 1, out=index).astype(np.intp)
+    return lut[index]
+
 def read_pcd(pc_pcd):
+    """
+    It reads the x/y/z, and the rgb, normals and intensity if any, of a PointCloud
+    
+    Args:
+      pc_pcd: a pypcd.PointCloud
+    
+    Returns:
+      A float32 (N, 3 + k) array, a view of the PCD data when it only holds x/y/z,
+      and {'rgb' / 'normal' / 'intensity': their columns in the array}
+    """
     # pc_pcd = pypcd.point_cloud_from_path(pcd_file)
-    pc = np.zeros((pc_pcd.pc_data.shape[0], 3))
-    pc[:, 0] = pc_pcd.pc_data['x']
-    pc[:, 1] = pc_pcd.pc_data['y']
-    pc[:, 2] = pc_pcd.pc_data['z']
+    data = pc_pcd.pc_data
+    normal = ['normal_x', 'normal_y', 'normal_z']
     fields = {}
     count = 3
     if 'rgb' in pc_pcd.fields:
-        append = pypcd.decode_rgb_from_pcl(pc_pcd.pc_data['rgb'])/255
-        pc = np.concatenate((pc, append), axis=1)
         fields['rgb'] = [count, count+1, count+2]
         count += 3
-    if 'normal_x' in pc_pcd.fields and 'normal_y' in pc_pcd.fields and 'normal_z' in pc_pcd.fields:        
-        append = pc_pcd.pc_data['normal_x'].reshape(-1, 1)
-        pc = np.concatenate((pc, append), axis=1)
-        append = pc_pcd.pc_data['normal_y'].reshape(-1, 1)
-        pc = np.concatenate((pc, append), axis=1)
-        append = pc_pcd.pc_data['normal_z'].reshape(-1, 1)
-        pc = np.concatenate((pc, append), axis=1)
+    if all(n in pc_pcd.fields for n in normal):
         fields['normal'] = [count, count+1, count+2]
         count += 3
-    if 'intensity' in pc_pcd.fields:        
-        append = pc_pcd.pc_data['intensity'].reshape(-1, 1)
-        pc = np.concatenate((pc, append), axis=1)
+    if 'intensity' in pc_pcd.fields:
         fields['intensity'] = [count]
         count += 1
-    
+
+    xyz = pypcd.field_view(data, ['x', 'y', 'z'])
+    if count == 3:
+        return xyz, fields
+
+    # one allocation, every field is written once into its columns
+    pc = np.empty((len(data), count), dtype=np.float32)
+    pc[:, :3] = xyz
+    if 'rgb' in fields:
+        pc[:, 3:6] = pypcd.decode_rgb_from_pcl(data['rgb'])
+        pc[:, 3:6] /= 255
+    if 'normal' in fields:
+        c = fields['normal'][0]
+        pc[:, c:c+3] = pypcd.field_view(data, normal)
+    if 'intensity' in fields:
+        pc[:, fields['intensity'][0]] = data['intensity']
     return pc, fields
       
 def load_scene(vis, pcd_path=None, scene = None, data_loader=None):
@@ -303,16 +365,16 @@ class Data_loader(object):
         return bboxes
     
     def transform_points(self, source_points: np.ndarray, transform: np.ndarray) -> np.ndarray:
-        if source_points.shape[1] == 3:
-            source_points = np.hstack((source_points, np.ones((source_points.shape[0], 1))))
-        
-        target_points = np.zeros(source_points.shape)
-        for i in range(source_points.shape[0]):
-            target_points[i] = np.dot(transform, source_points[i])
-        
-        return target_points[:, :3]
+        return transform_points(source_points, transform)
     
     def load_human_mesh_data(self, file_name):
+        """
+        It loads the SMPL persons of a npz file as meshes in the camera coordinates,
+        all the persons are skinned in one batch
+
+        Returns:
+          A list of o3d.geometry.TriangleMesh, one per person.
+        """
         data = np.load(file_name)
         poses = data["body_pose"]
         betas = data["betas"]
@@ -320,21 +382,17 @@ class Data_loader(object):
         
         trans_lidar2cam = np.array([[-0.0087265, -0.9999619,  0.0000000,0.03], [-0.1561634,  0.0013628, -0.9877303,-0.05], [0.9876927, -0.0086194, -0.1561694,0], [0, 0, 0, 1]])
         meshes = []
-        for pose, beta, t in zip(poses, betas, trans):
-            smpl_model = SMPL()
-            pose = torch.tensor(pose.reshape(1, -1))
-            beta = torch.tensor(beta.reshape(1, -1))
-            vertices = smpl_model(pose=pose, beta=beta).cpu().numpy()[0]
-            vertices += t
-            
-            vertices = self.transform_points(source_points=vertices, transform=trans_lidar2cam.T)
-            
-            mesh = o3d.io.read_triangle_mesh(os.path.join(os.path.dirname(__file__), "../smpl", 'sample.ply'))
-            mesh.vertex_colors = o3d.utility.Vector3dVector()
-            
-            mesh.vertices = o3d.utility.Vector3dVector(vertices)
-            mesh.vertex_normals = o3d.utility.Vector3dVector()
-            mesh.triangle_normals = o3d.utility.Vector3dVector()
+        if len(poses) == 0:
+            return meshes
+
+        vertices = poses_to_vertices(poses.reshape(len(poses), -1),
+                                     trans.reshape(len(trans), 3),
+                                     beta=betas.reshape(len(betas), -1))
+        transform_points(vertices, trans_lidar2cam.T, out=vertices)
+
+        triangles = o3d.utility.Vector3iVector(smpl_faces())
+        for verts in vertices:
+            mesh = o3d.geometry.TriangleMesh(o3d.utility.Vector3dVector(verts.astype(np.float64)), triangles)
             mesh.compute_vertex_normals()
             meshes.append(mesh)
             
@@ -356,14 +414,14 @@ class Data_loader(object):
             pointcloud = o3d.geometry.PointCloud()
             
         if file_name.endswith('.txt'):
-            pts = np.loadtxt(file_name)
+            pts = load_txt(file_name)
             xyz = [1,2,3] if pts.shape[1] == 9 else [0,1,2]
             pointcloud.points = o3d.utility.Vector3dVector(pts[:, xyz]) 
         elif file_name.endswith('.pcd'):
             if self.remote:
-                pcd, fields = read_pcd_from_server(self.client, file_name, self.sftp_client)
+                pcd, fields = read_pcd_from_server(self.client, file_name, self.sftp_client, RENDERED_PCD_FIELDS)
             else:
-                pcd, fields = read_pcd(pypcd.point_cloud_from_path(file_name)) 
+                pcd, fields = read_pcd(pypcd.point_cloud_from_path(file_name, mmap_mode='c', fields=RENDERED_PCD_FIELDS))
 
             pointcloud.points = o3d.utility.Vector3dVector(pcd[:, :3])
             if 'normal' in fields:
@@ -373,12 +431,7 @@ class Data_loader(object):
                 pointcloud.colors = o3d.utility.Vector3dVector(pcd[:, fields['rgb']])
 
             elif 'intensity' in fields:
-                if pcd[:, fields['intensity']].max() > 255:
-                    intensity = np.array([155 * np.log2(i/100) / np.log2(864) + 100 if i > 100 else i for i in pcd[:, fields['intensity']]]).squeeze()
-                else:
-                    intensity = pcd[:, fields['intensity']].squeeze()
-                scale = 1 if intensity.max() < 1.1 else 255
-                colors = plt.get_cmap(cmap)(intensity/scale)[:, :3]
+                colors = intensity_to_colors(pcd[:, fields['intensity']], cmap)
                 pointcloud.colors = o3d.utility.Vector3dVector(colors)
 
             if position is not None:
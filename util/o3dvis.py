@@ -17,7 +17,7 @@ import numpy as np
 import cv2
 import os
 import matplotlib.pyplot as plt
-from util import client_server, list_dir_remote, read_pcd_from_server, images_to_video
+from util import client_server, list_dir_remote, read_pcd_from_server, images_to_video, load_txt
 
     
 colors = {
@@ -482,7 +482,7 @@ class o3dvis():
             else:
                 color = 'blue'
             trajfile = os.path.join(plydir, trajfile)
-            trajs = np.loadtxt(trajfile)[:,1:4]
+            trajs = load_txt(trajfile)[:,1:4]
             traj_cloud = o3d.geometry.PointCloud()
             # show as points
             traj_cloud.points = o3d.utility.Vector3dVector(trajs)
@@ -588,7 +588,7 @@ class o3dvis():
             mesh_list.clear()
 
             if file_name.endswith('.txt'):
-                pts = np.loadtxt(os.path.join(file_path, file_name))
+                pts = load_txt(os.path.join(file_path, file_name))
                 pointcloud.points = o3d.utility.Vector3dVector(pts[:, :3])  
             elif file_name.endswith('.pcd') or file_name.endswith('.ply'):
                 if remote:
@@ -11,12 +11,15 @@
 # HISTORY:                                                                     #
 ################################################################################
 
+import io
+import os
 import re
 import struct
 import copy
 from io import BytesIO as sio
 # import cStringIO as sio
 import numpy as np
+from numpy.lib.recfunctions import repack_fields
 import warnings
 import lzf
 
@@ -44,6 +47,8 @@ __all__ = ['PointCloud',
            'build_ascii_fmtstr',
            'encode_rgb_for_pcl',
            'decode_rgb_from_pcl',
+           'field_view',
+           'select_fields',
            'save_point_cloud',
            'save_point_cloud_bin',
            'save_point_cloud_bin_compressed',
@@ -232,20 +237,75 @@ def build_ascii_fmtstr(pc):
     return fmtstr
 
 
-def parse_ascii_pc_data(f, dtype, metadata):
+def select_fields(metadata, fields):
+    """ The metadata restricted to the PCD `fields`, in file order.
+
+    The requested fields missing from the file are ignored.
+    """
+    keep = [i for i, f in enumerate(metadata['fields']) if f in fields]
+    selected = metadata.copy()
+    for key in ('fields', 'size', 'type', 'count'):
+        selected[key] = [metadata[key][i] for i in keep]
+    return selected
+
+
+def parse_ascii_pc_data(f, dtype, metadata, out_dtype=None):
     """ Use numpy to parse ascii pointcloud data.
     """
-    return np.loadtxt(f, dtype=dtype, delimiter=' ')
+    if out_dtype is None:
+        return np.loadtxt(f, dtype=dtype, delimiter=' ')
+    usecols = [dtype.names.index(name) for name in out_dtype.names]
+    return np.loadtxt(f, dtype=out_dtype, delimiter=' ', usecols=usecols)
 
 
-def parse_binary_pc_data(f, dtype, metadata):
-    rowstep = metadata['points']*dtype.itemsize
-    # for some reason pcl adds empty space at the end of files
-    buf = f.read(rowstep)
-    return np.fromstring(buf, dtype=dtype)
+def _read_exactly(f, size):
+    """ Read `size` bytes of f into one writable buffer, in place when f has readinto.
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    readinto = getattr(f, 'readinto', None)
+    n = 0
+    while n < size:
+        if readinto is not None:
+            k = readinto(view[n:])
+        else:
+            chunk = f.read(size - n)
+            k = len(chunk)
+            view[n:n + k] = chunk
+        if not k:
+            break
+        n += k
+    if n < size:
+        raise IOError('PCD data truncated: %d of %d bytes' % (n, size))
+    return buf
+
+
+# rows of a binary file read at once when only some fields are kept
+_CHUNK_BYTES = 1 << 24
+
+
+def parse_binary_pc_data(f, dtype, metadata, out_dtype=None):
+    if out_dtype is None:
+        rowstep = metadata['points']*dtype.itemsize
+        # for some reason pcl adds empty space at the end of files
+        buf = _read_exactly(f, rowstep)
+        # the structured array is a view of the buffer, no copy
+        return np.frombuffer(buf, dtype=dtype)
+
+    # the rows are read chunk by chunk and only the strided columns of the
+    # requested fields are kept
+    n = metadata['points']
+    pc_data = np.empty(n, dtype=out_dtype)
+    rows = max(1, _CHUNK_BYTES // dtype.itemsize)
+    for lb in range(0, n, rows):
+        k = min(rows, n - lb)
+        chunk = np.frombuffer(_read_exactly(f, k * dtype.itemsize), dtype=dtype)
+        for name in out_dtype.names:
+            pc_data[name][lb:lb + k] = chunk[name]
+    return pc_data
 
 
-def parse_binary_compressed_pc_data(f, dtype, metadata):
+def parse_binary_compressed_pc_data(f, dtype, metadata, out_dtype=None):
     """ Parse lzf-compressed data.
     Format is undocumented but seems to be:
     - compressed size of data (uint32)
@@ -257,26 +317,47 @@ def parse_binary_compressed_pc_data(f, dtype, metadata):
     compressed_size, uncompressed_size =\
         struct.unpack(fmt, f.read(struct.calcsize(fmt)))
     compressed_data = f.read(compressed_size)
-    # TODO what to use as second argument? if buf is None
-    # (compressed > uncompressed)
-    # should we read buf as raw binary?
-    buf = lzf.decompress(compressed_data, uncompressed_size)
+    if compressed_size == uncompressed_size:
+        # lzf output is always smaller, the writer stored incompressible data as is
+        buf = compressed_data
+    else:
+        buf = lzf.decompress(compressed_data, uncompressed_size)
     if len(buf) != uncompressed_size:
         raise IOError('Error decompressing data')
-    # the data is stored field-by-field
-    pc_data = np.zeros(metadata['width'], dtype=dtype)
+    # the data is stored field-by-field, every column is a (points, itemsize)
+    # byte view of buf and the rows are interleaved in one concatenate
+    n = metadata['points']
+    out_dtype = dtype if out_dtype is None else out_dtype
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    columns = []
     ix = 0
-    for dti in range(len(dtype)):
-        dt = dtype[dti]
-        bytes = dt.itemsize * metadata['width']
-        column = np.fromstring(buf[ix:(ix+bytes)], dt)
-        pc_data[dtype.names[dti]] = column
-        ix += bytes
-    return pc_data
+    for name in dtype.names:
+        size = dtype.fields[name][0].itemsize
+        if name in out_dtype.names:
+            columns.append(raw[ix:ix + size * n].reshape(n, size))
+        ix += size * n
+    return np.concatenate(columns, axis=1).view(out_dtype).reshape(n)
 
 
-def point_cloud_from_fileobj(f):
-    """ Parse pointcloud coming from file object f
+def _encode_columns(pc_data):
+    """ The bytes of pc_data stored field-by-field, as in binary_compressed.
+    """
+    pc_data = np.ascontiguousarray(pc_data)
+    n = len(pc_data)
+    rows = pc_data.view(np.uint8).reshape(n, pc_data.dtype.itemsize)
+    out = np.empty(sum(pc_data.dtype.fields[name][0].itemsize for name in pc_data.dtype.names) * n,
+                   dtype=np.uint8)
+    ix = 0
+    for name in pc_data.dtype.names:
+        dt, offset = pc_data.dtype.fields[name][:2]
+        # written straight into the output, no per-field temporary
+        out[ix:ix + dt.itemsize * n].reshape(n, dt.itemsize)[:] = rows[:, offset:offset + dt.itemsize]
+        ix += dt.itemsize * n
+    return out.tobytes()
+
+
+def _read_header(f):
+    """ Read the header lines of f up to DATA.
     """
     header = []
     while True:
@@ -285,34 +366,105 @@ def point_cloud_from_fileobj(f):
         if ln.startswith('DATA'):
             metadata = parse_header(header)
             dtype = _build_dtype(metadata)
-            break
+            return metadata, dtype
+
+
+def point_cloud_from_fileobj(f, fields=None):
+    """ Parse pointcloud coming from file object f
+
+    fields: the PCD fields to keep, e.g. ['x', 'y', 'z', 'intensity'], the
+    other ones are skipped. Defaults to all of them.
+    """
+    metadata, dtype = _read_header(f)
+    out_dtype = None
+    if fields is not None:
+        metadata = select_fields(metadata, fields)
+        out_dtype = _build_dtype(metadata)
     if metadata['data'] == 'ascii':
-        pc_data = parse_ascii_pc_data(f, dtype, metadata)
+        pc_data = parse_ascii_pc_data(f, dtype, metadata, out_dtype)
     elif metadata['data'] == 'binary':
-        pc_data = parse_binary_pc_data(f, dtype, metadata)
+        pc_data = parse_binary_pc_data(f, dtype, metadata, out_dtype)
     elif metadata['data'] == 'binary_compressed':
-        pc_data = parse_binary_compressed_pc_data(f, dtype, metadata)
+        pc_data = parse_binary_compressed_pc_data(f, dtype, metadata, out_dtype)
     else:
         print('DATA field is neither "ascii" or "binary" or\
                 "binary_compressed"')
     return PointCloud(metadata, pc_data)
 
 
-def point_cloud_from_path(fname):
+def point_cloud_from_path(fname, mmap_mode=None, fields=None, ascii_cache=False):
     """ load point cloud in binary format
+
+    mmap_mode: 'r' or 'c' memory-maps the data of binary files instead of
+    reading it, only the touched pages are loaded.
+    fields: the PCD fields to keep, see `point_cloud_from_fileobj`.
+    ascii_cache: an ascii file is converted once to a binary sidecar
+    `fname.bin.pcd`, read instead while it is newer than the file.
     """
+    if ascii_cache:
+        sidecar = fname + '.bin.pcd'
+        if os.path.isfile(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(fname):
+            return point_cloud_from_path(sidecar, mmap_mode, fields)
+        with open(fname, 'rb') as f:
+            is_ascii = _read_header(f)[0]['data'] == 'ascii'
+        if is_ascii:
+            pc = point_cloud_from_path(fname)
+            try:
+                with open(sidecar + '.tmp', 'wb') as f:
+                    point_cloud_to_fileobj(pc, f, 'binary')
+                os.replace(sidecar + '.tmp', sidecar)
+            except (IOError, OSError) as e:
+                warnings.warn('%s not saved: %s' % (sidecar, e))
+            if fields is not None:
+                metadata = select_fields(pc.get_metadata(), fields)
+                pc = PointCloud(metadata, repack_fields(pc.pc_data[list(_build_dtype(metadata).names)]))
+            return pc
+
     with open(fname, 'rb') as f:
-        pc = point_cloud_from_fileobj(f)
-    return pc
+        if mmap_mode is None:
+            return point_cloud_from_fileobj(f, fields)
+        metadata, dtype = _read_header(f)
+        offset = f.tell()
+        if metadata['data'] != 'binary':
+            f.seek(0)
+            return point_cloud_from_fileobj(f, fields)
+    pc_data = np.memmap(fname, dtype=dtype, mode=mmap_mode, offset=offset,
+                        shape=(metadata['points'],))
+    if fields is not None:
+        # a multi-field view of the map, the other fields are never touched
+        metadata = select_fields(metadata, fields)
+        pc_data = pc_data[list(_build_dtype(metadata).names)]
+    return PointCloud(metadata, pc_data)
 
 
 def point_cloud_from_buffer(buf):
-    fileobj = sio.StringIO(buf)
+    fileobj = sio(buf)
     pc = point_cloud_from_fileobj(fileobj)
     fileobj.close()  # necessary?
     return pc
 
 
+def field_view(pc_data, names, dtype=np.float32):
+    """ The fields `names` of a structured array as one (N, len(names)) array.
+
+    It is a view of pc_data when the fields are adjacent and of type `dtype`
+    (e.g. x y z float32), otherwise the columns are copied to a new array.
+    """
+    dtype = np.dtype(dtype)
+    fields = [pc_data.dtype.fields[name] for name in names]
+    adjacent = all(dt == dtype and off == fields[0][1] + i * dtype.itemsize
+                   for i, (dt, off) in enumerate(fields))
+    if adjacent and pc_data.ndim == 1:
+        first = pc_data[names[0]]
+        return np.lib.stride_tricks.as_strided(
+            first, shape=(len(pc_data), len(names)),
+            strides=(first.strides[0], dtype.itemsize))
+    out = np.empty((len(pc_data), len(names)), dtype=dtype)
+    for i, name in enumerate(names):
+        out[:, i] = pc_data[name]
+    return out
+
+
 def point_cloud_to_fileobj(pc, fileobj, data_compression=None):
     """ Write pointcloud as .pcd to fileobj.
     If data_compression is not None it overrides pc.data.
@@ -325,7 +477,8 @@ def point_cloud_to_fileobj(pc, fileobj, data_compression=None):
 
     header = write_header(metadata)
     
-    if data_compression == 'binary':
+    # ascii data can go to a text file, everything else needs a binary one
+    if metadata['data'].lower() != 'ascii' or not isinstance(fileobj, io.TextIOBase):
         header = str.encode(header)
         
     fileobj.write(header)
@@ -333,24 +486,21 @@ def point_cloud_to_fileobj(pc, fileobj, data_compression=None):
         fmtstr = build_ascii_fmtstr(pc)
         np.savetxt(fileobj, pc.pc_data, fmt=fmtstr)
     elif metadata['data'].lower() == 'binary':
-        fileobj.write(pc.pc_data.tostring('C'))
+        # a multi-field view keeps the offsets of its source, pack it first
+        fileobj.write(np.ascontiguousarray(repack_fields(pc.pc_data)).tobytes())
     elif metadata['data'].lower() == 'binary_compressed':
         # TODO
         # a '_' field is ignored by pcl and breakes compressed point clouds.
         # changing '_' to '_padding' or other name fixes this.
         # admittedly padding shouldn't be compressed in the first place.
         # reorder to column-by-column
-        uncompressed_lst = []
-        for fieldname in pc.pc_data.dtype.names:
-            column = np.ascontiguousarray(pc.pc_data[fieldname]).tostring('C')
-            uncompressed_lst.append(column)
-        uncompressed = ''.join(uncompressed_lst)
+        uncompressed = _encode_columns(pc.pc_data)
         uncompressed_size = len(uncompressed)
         # print("uncompressed_size = %r"%(uncompressed_size))
         buf = lzf.compress(uncompressed)
         if buf is None:
-            # compression didn't shrink the file
-            # TODO what do to do in this case when reading?
+            # compression didn't shrink the file, the data is stored as is
+            # and the reader recognizes it by compressed_size == uncompressed_size
             buf = uncompressed
             compressed_size = uncompressed_size
         else:
@@ -738,12 +888,12 @@ class PointCloud(object):
         return numpy_pc2.array_to_pointcloud2(self.pc_data)
 
     @staticmethod
-    def from_path(fname):
-        return point_cloud_from_path(fname)
+    def from_path(fname, mmap_mode=None, fields=None):
+        return point_cloud_from_path(fname, mmap_mode, fields)
 
     @staticmethod
-    def from_fileobj(fileobj):
-        return point_cloud_from_fileobj(fileobj)
+    def from_fileobj(fileobj, fields=None):
+        return point_cloud_from_fileobj(fileobj, fields)
 
     @staticmethod
     def from_buffer(buf):
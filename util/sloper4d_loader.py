@@ -1,4 +1,5 @@
 import os
+import sys
 import argparse
 
 import pickle
@@ -10,6 +11,10 @@ import open3d as o3d
 from scipy.spatial.transform import Rotation as R
 from torch.utils.data import Dataset, DataLoader
 
+sys.path.append('.')
+sys.path.append('..')
+from util.tool_func import transform_points
+
 def camera_to_pixel(X, intrinsics, distortion_coefficients):
     # focal length
     f = intrinsics[:2]
@@ -31,17 +36,12 @@ def camera_to_pixel(X, intrinsics, distortion_coefficients):
 
 def world_to_pixels(X, extrinsic_matrix, cam):
     B, N, dim = X.shape
-    X = np.concatenate((X, np.ones((B, N, 1))), axis=-1).transpose(0, 2, 1)
-    X = (extrinsic_matrix @ X).transpose(0, 2, 1)
-    X = camera_to_pixel(X[..., :3].reshape(B*N, dim), cam['intrinsics'], [0]*5)
+    X = transform_points(X, extrinsic_matrix)
+    X = camera_to_pixel(X.reshape(B*N, dim), cam['intrinsics'], [0]*5)
     X = X.reshape(B, N, -1)
     
     def check_pix(p):
-        rule1 = p[:, 0] > 0
-        rule2 = p[:, 0] < cam['width']
-        rule3 = p[:, 1] > 0
-        rule4 = p[:, 1] < cam['height']
-        rule  = [a and b and c and d for a, b, c, d in zip(rule1, rule2, rule3, rule4)]
+        rule = (p[:, 0] > 0) & (p[:, 0] < cam['width']) & (p[:, 1] > 0) & (p[:, 1] < cam['height'])
         return p[rule] if len(rule) > 50 else []
     
     X = [check_pix(xx) for xx in X]
@@ -33,6 +33,61 @@ def read_json_file(file_name):
             data = {}
     return data
 
+# keep a binary .npy next to every txt read by `load_txt`, read instead of the text afterwards
+TXT_SIDECAR_CACHE = False
+
+def load_txt(file_name, cache=None):
+    """
+    `np.loadtxt(file_name)` of a whitespace separated table, with an optional binary
+    sidecar so that a table is only parsed once
+    
+    Args:
+      file_name: the txt file
+      cache: keep a binary .npy sidecar of the table next to the file, read instead
+        of the text while it is newer. Defaults to TXT_SIDECAR_CACHE
+    
+    Returns:
+      The float64 array, squeezed as np.loadtxt does.
+    """
+    cache = TXT_SIDECAR_CACHE if cache is None else cache
+    sidecar = file_name + '.npy'
+    if cache and os.path.isfile(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(file_name):
+        return np.load(sidecar)
+
+    data = np.loadtxt(file_name)
+    if cache:
+        try:
+            with open(sidecar + '.tmp', 'wb') as f:
+                np.save(f, data)
+            os.replace(sidecar + '.tmp', sidecar)
+        except OSError as e:
+            print(f'[WARNING] {sidecar} not saved: {e}')
+    return data
+
+def transform_points(points, transform, out=None, dtype=None):
+    """
+    Homogeneous transform of points in one matmul, `transform @ [p, 1]` for every point
+    
+    Args:
+      points: (N, 3) or a batch (B, N, 3), homogeneous (..., 4) points are accepted
+      transform: (4, 4), or (B, 4, 4) one transform per frame
+      out: the array to write into, `out=points` transforms in place
+      dtype: dtype of the result when `out` is None, np.float32 halves the memory.
+        Defaults to the dtype of the points (at least float32)
+    
+    Returns:
+      The transformed points (..., N, 3).
+    """
+    points = np.asarray(points)[..., :3]
+    transform = np.asarray(transform)
+    if dtype is None:
+        dtype = out.dtype if out is not None else np.result_type(points.dtype, np.float32)
+    rot = np.swapaxes(transform[..., :3, :3], -1, -2).astype(dtype)
+    t = transform[..., None, :3, 3].astype(dtype)
+    out = np.matmul(points.astype(dtype, copy=False), rot, out=out)
+    out += t
+    return out
+
 def extrinsic_to_cam(extrinsic):
     cam = np.eye(4)
     cam[:3, :3] = extrinsic[:3, :3].T @ np.array([[1,0,0],[0,-1,0],[0,0,-1]])
@@ -16,6 +16,7 @@ from pkg_resources import ExtractionError
 from scipy.spatial.transform import Rotation as R
 from copy import deepcopy
 from .tool_func import filterTraj
+from smpl.rotation import axis_angle_to_matrix
 
 def make_cloud_in_vis_center(point_cloud):
     center = point_cloud.get_center()
@@ -50,9 +51,10 @@ def get_head_global_rots(pose, parents=[0, 3, 6, 9, 12, 15]):
     if pose.shape[1] == 72:
         pose = pose.reshape(-1, 24, 3)
 
-    rots = np.eye(3)
-    for r in parents[::-1]:
-        rots = R.from_rotvec(pose[:, r]).as_matrix() @ rots
+    local_rots = axis_angle_to_matrix(np.asarray(pose[:, parents], dtype=np.float64))
+    rots = local_rots[:, 0]
+    for i in range(1, len(parents)):
+        rots = rots @ local_rots[:, i]
     rots = rots @ np.array([[-1, 0, 0], [0, 0, 1], [0, 1, 0]]).T
     return rots
 